@@ -0,0 +1,268 @@
+#! /usr/bin/env python3
+
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Microbenchmarks of the hot functions.
+#
+# Times the functions on the request path (and loading presentations) in
+# isolation, over a range of realistic sizes, and measures their memory use
+# per call: the peak of the memory allocated during a call (temporary objects
+# included), and the memory blocks still allocated after it (what a call
+# retains, in caches for example). Prints the results as JSON, so the results
+# of two commits can be compared.
+#
+# usage: python3 bench/micro.py [--filter <substring>] [--time <seconds>]
+#		[--output <file>]
+
+import sys
+import os
+import gc
+import time
+import json
+import shutil
+import tempfile
+import tracemalloc
+import subprocess
+from types import SimpleNamespace
+
+root = os.path.split(os.path.dirname(os.path.abspath(__file__)))[0]
+sys.path.insert(0, root)
+
+from waterslide import presentation, httputils, multiplex, cache
+
+## Time and measure the memory use of a function
+# @param func		Function without arguments to benchmark
+# @param seconds	Minimum time to spend timing it
+# @return		Results of the function
+def measure(func, seconds):
+	func()
+
+	# find a number of calls which takes long enough to time reliably
+	number = 1
+	while True:
+		t = time.perf_counter()
+		for _ in range(number):
+			func()
+		dt = time.perf_counter() - t
+
+		if dt > .05:
+			break
+		number *= 2
+
+	best = dt / number
+	deadline = time.perf_counter() + seconds
+
+	while time.perf_counter() < deadline:
+		t = time.perf_counter()
+		for _ in range(number):
+			func()
+		best = min(best, (time.perf_counter() - t) / number)
+
+	# the memory is measured separately, since tracing slows everything down
+	calls = min(number, 1000)
+	gc.collect()
+	blocks = sys.getallocatedblocks()
+	for _ in range(calls):
+		func()
+	gc.collect()
+	retained = (sys.getallocatedblocks() - blocks) / calls
+
+	tracemalloc.start()
+	base = tracemalloc.get_traced_memory()[0]
+	func()
+	peak = tracemalloc.get_traced_memory()[1] - base
+	tracemalloc.stop()
+
+	return {
+		'us_per_call': best * 1e6,
+		'peak_bytes_per_call': peak,
+		'retained_blocks_per_call': retained,
+	}
+
+## Write a synthetic presentation
+# @param path		Directory to write it in
+# @param slides	Amount of slides
+def write_presentation(path, slides):
+	os.makedirs(path)
+
+	with open(os.path.join(path, 'index.html'), 'w') as f:
+		f.write('title: Micro\ninit:\n transition: concave\n<!-- EOC -->\n')
+
+		for s in range(slides):
+			f.write('<section>\n<h1>Slide {}</h1>\n<p>{}</p>\n</section>\n'.format(
+				s, ' '.join('lorem' for _ in range(50))))
+
+## Get a presentation configuration
+def pconf():
+	c = presentation.PConf()
+	c.load(multiplex.MConf())
+	return c
+
+## Get an object which looks like a request of aiohttp
+# @param path		Path of the request
+# @param headers	Headers of the request
+def aio_request(path = '/deck/index.html', headers = {}):
+	return SimpleNamespace(
+		version = (1, 1),
+		method = 'GET',
+		headers = headers,
+		scheme = 'http',
+		host = '127.0.0.1:9090',
+		path = path,
+		query = {},
+		read = lambda: b'',
+	)
+
+## Benchmarks, as (name, parameters, setup), where setup returns the function
+# to benchmark for a parameter
+def benchmarks(tmp):
+	conf = pconf()
+	decks = {}
+
+	def deck(slides):
+		if slides not in decks:
+			path = os.path.join(tmp, 'deck-{}'.format(slides))
+			write_presentation(path, slides)
+			decks[slides] = presentation.HTTP_Presentation(path, conf)
+		return decks[slides]
+
+	def get_html(slides):
+		p = deck(slides)
+		return lambda: p.get_html()
+
+	def reveal_init_json(slides):
+		p = deck(slides)
+		return lambda: p.reveal_init_json()
+
+	def client_has_cached(header):
+		path = os.path.join(tmp, 'cached')
+		open(path, 'w').close()
+
+		mtime = os.path.getmtime(path)
+		headers = {
+			'none': {},
+			'stale': {'if-modified-since': 'Thu, 1 Jan 1970 00:00:00 GMT'},
+			'fresh': {'if-modified-since':
+				time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(mtime))},
+		}[header]
+
+		request = httputils.convert(aio_request(headers = headers))
+		return lambda: httputils.client_has_cached(path, request)
+
+	def cache_hit(depth):
+		f = cache.cache(depth = depth)(lambda key: key)
+		f(0)
+		return lambda: f(0)
+
+	def cache_miss(depth):
+		f = cache.cache(depth = depth)(lambda key: key)
+		keys = iter(range(1 << 62))
+		return lambda: f(next(keys))
+
+	def verify(alg_rlen):
+		alg, rlen = alg_rlen
+		htype = multiplex.algs_avail[alg]
+		plain = 'x' * rlen
+		digest = htype.encrypt(plain)
+		return lambda: htype.verify(plain, digest)
+
+	def convert(_):
+		request = aio_request()
+		return lambda: httputils.convert(request, lambda r: r.path[1:])
+
+	def export(size):
+		response = httputils.HTTP_Response(
+			code = 200,
+			headers = {'Content-type': 'text/css'},
+			body = b'x' * size)
+		return lambda: httputils.export(response)
+
+	def loadl(n):
+		paths = []
+
+		for i in range(n):
+			path = os.path.join(tmp, 'load-{}-{}'.format(n, i))
+			write_presentation(path, 20)
+			paths.append(path)
+
+		return lambda: presentation.loadl(paths, conf, verbosity = 0)
+
+	return (
+		('Presentation.get_html', (10, 100, 1000), get_html),
+		('Presentation.reveal_init_json', (10, 100, 1000), reveal_init_json),
+		('httputils.client_has_cached', ('none', 'stale', 'fresh'), client_has_cached),
+		('cache.cache hit', (32, 256), cache_hit),
+		('cache.cache miss', (32, 256), cache_miss),
+		('multiplex verify', (('md5', 16), ('sha512', 16), ('sha512', 64)), verify),
+		('httputils.convert', (None,), convert),
+		('httputils.export', (1 << 10, 1 << 16), export),
+		('presentation.loadl', (1, 8, 32), loadl),
+	)
+
+## Get the commit the benchmark runs on
+def commit():
+	try:
+		return subprocess.run(['git', 'rev-parse', 'HEAD'],
+			cwd = root,
+			stdout = subprocess.PIPE,
+			stderr = subprocess.DEVNULL,
+			check = True,
+		).stdout.decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def main():
+	only = None
+	seconds = .5
+	output = None
+
+	i = 1
+	while i < len(sys.argv):
+		if sys.argv[i] == '--filter':
+			only = sys.argv[i+1]
+			i += 1
+		elif sys.argv[i] == '--time':
+			seconds = float(sys.argv[i+1])
+			i += 1
+		elif sys.argv[i] == '--output':
+			output = sys.argv[i+1]
+			i += 1
+		i += 1
+
+	tmp = tempfile.mkdtemp(prefix = 'waterslide-micro-')
+
+	results = {
+		'commit': commit(),
+		'python': sys.version.split()[0],
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+		'results': {},
+	}
+
+	try:
+		for name, params, setup in benchmarks(tmp):
+			if only and only not in name:
+				continue
+
+			for param in params:
+				key = name if param is None else '{} [{}]'.format(name,
+					'-'.join(map(str, param)) if isinstance(param, tuple) else param)
+
+				results['results'][key] = measure(setup(param), seconds)
+	finally:
+		shutil.rmtree(tmp, ignore_errors = True)
+
+	text = json.dumps(results, indent = 1)
+
+	if output:
+		with open(output, 'w') as f:
+			f.write(text + '\n')
+
+	print(text)
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,351 @@
+#! /usr/bin/env python3
+
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# HTTP benchmark of the serve and manage subcommands.
+#
+# Generates a document root of synthetic presentations, serves it with the
+# serve and/or manage subcommands, and requests the presentation pages,
+# revalidates them (304 responses), static files and sass stylesheets with a
+# built-in keep-alive load generator. Prints requests per second and latency
+# percentiles per kind of request, as JSON, so the results of two commits can
+# be compared.
+#
+# usage: python3 bench/serving.py [--decks <n>] [--slides <n>] [--asset-kib <n>]
+#		[--scss-depth <n>] [--requests <n>] [--concurrency <n>]
+#		[--mode serve|manage|both] [--port <port>] [--output <file>]
+
+import sys
+import os
+import time
+import json
+import random
+import socket
+import shutil
+import asyncio
+import tempfile
+import subprocess
+
+root = os.path.split(os.path.dirname(os.path.abspath(__file__)))[0]
+
+## Generate a document root of synthetic presentations
+# @param path		Directory to generate it in
+# @param decks		Amount of presentations
+# @param slides	Amount of slides per presentation
+# @param asset_kib	Size of the static file of each presentation, in KiB
+# @param scss_depth	Amount of partials the stylesheet imports, one by one
+# @return		List of the directories of the presentations
+def generate(path, decks, slides, asset_kib, scss_depth):
+	rng = random.Random(0)
+	ret = []
+
+	for d in range(decks):
+		deck = os.path.join(path, 'deck-{}'.format(d))
+		os.mkdir(deck)
+		ret.append(deck)
+
+		with open(os.path.join(deck, 'index.html'), 'w') as f:
+			f.write('title: Deck {}\nstyles:\n - style.scss\n<!-- EOC -->\n'.format(d))
+
+			for s in range(slides):
+				f.write('<section>\n<h1>Slide {}</h1>\n<p>{}</p>\n</section>\n'.format(
+					s, ' '.join('lorem' for _ in range(50))))
+
+		# a chain of partials, each importing the next one
+		imports = ['part{}'.format(i) for i in range(scss_depth)]
+
+		for i, name in enumerate(imports):
+			with open(os.path.join(deck, '_{}.scss'.format(name)), 'w') as f:
+				if i + 1 < len(imports):
+					f.write('@import "{}";\n'.format(imports[i + 1]))
+				f.write('$c{}: #{:06x};\n.c{} {{ color: $c{}; }}\n'.format(i, rng.getrandbits(24), i, i))
+
+		with open(os.path.join(deck, 'style.scss'), 'w') as f:
+			if imports:
+				f.write('@import "{}";\n'.format(imports[0]))
+			f.write('.deck-{} {{ font-size: 12px; }}\n'.format(d))
+
+		with open(os.path.join(deck, 'image.png'), 'wb') as f:
+			f.write(bytes(rng.getrandbits(8) for _ in range(asset_kib * 1024)))
+
+	return ret
+
+## Find a free port to serve on
+def free_port():
+	with socket.socket() as s:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+
+## Start a server, and wait until it accepts connections
+# @param args	Arguments passed to the wslide script
+# @param port	Port the server listens on
+# @return	The server process
+def start_server(args, port):
+	proc = subprocess.Popen([sys.executable, os.path.join(root, 'wslide')] + args,
+		cwd = root,
+		stdout = subprocess.DEVNULL,
+		)
+
+	deadline = time.monotonic() + 60
+
+	while time.monotonic() < deadline:
+		if proc.poll() is not None:
+			raise RuntimeError('server exited with {}'.format(proc.returncode))
+
+		try:
+			socket.create_connection(('127.0.0.1', port), timeout = 1).close()
+			return proc
+		except OSError:
+			time.sleep(.1)
+
+	proc.kill()
+	raise RuntimeError('server did not start')
+
+## Keep-alive HTTP/1.1 connection
+class Connection():
+
+	def __init__(self, port):
+		self.port = port
+		self.reader = None
+		self.writer = None
+
+	## Send a GET request and read the response
+	# @param self		Object pointer
+	# @param path		Path to request
+	# @param headers	Extra request headers
+	# @return		(status, headers, body)
+	async def get(self, path, headers = {}):
+		if self.writer is None:
+			self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+
+		self.writer.write('GET {} HTTP/1.1\r\nHost: 127.0.0.1:{}\r\n{}\r\n'.format(
+			path, self.port, ''.join('{}: {}\r\n'.format(k, v) for k, v in headers.items())
+			).encode('latin-1'))
+
+		status = int((await self.reader.readline()).split()[1])
+		resp = {}
+
+		while True:
+			line = (await self.reader.readline()).decode('latin-1').rstrip('\r\n')
+
+			if not line:
+				break
+
+			k, v = line.split(':', 1)
+			resp[k.strip().lower()] = v.strip()
+
+		if resp.get('transfer-encoding') == 'chunked':
+			body = b''
+
+			while True:
+				size = int((await self.reader.readline()).split(b';')[0], 16)
+				body += await self.reader.readexactly(size + 2)
+
+				if size == 0:
+					break
+		else:
+			body = await self.reader.readexactly(int(resp.get('content-length', 0)))
+
+		if resp.get('connection') == 'close':
+			self.close()
+
+		return status, resp, body
+
+	def close(self):
+		if self.writer:
+			self.writer.close()
+		self.writer = None
+
+## Get a percentile of sorted values
+def percentile(values, p):
+	if not values:
+		return None
+
+	return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+## Request a list of (path, headers) as fast as possible
+# @param port		Port the server listens on
+# @param targets	List of (path, headers), requested round robin
+# @param requests	Total amount of requests
+# @param concurrency	Amount of connections
+# @return		Results
+async def load(port, targets, requests, concurrency):
+	latencies = []
+	statuses = {}
+	errors = 0
+	counter = iter(range(requests))
+
+	async def client():
+		nonlocal errors
+		conn = Connection(port)
+
+		for n in counter:
+			path, headers = targets[n % len(targets)]
+			t = time.perf_counter()
+
+			try:
+				status, _, _ = await conn.get(path, headers)
+			except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+				errors += 1
+				conn.close()
+				continue
+
+			latencies.append(time.perf_counter() - t)
+			statuses[status] = statuses.get(status, 0) + 1
+
+		conn.close()
+
+	t = time.perf_counter()
+	await asyncio.gather(*(client() for _ in range(concurrency)))
+	elapsed = time.perf_counter() - t
+
+	latencies.sort()
+
+	return {
+		'requests': len(latencies),
+		'errors': errors,
+		'statuses': {str(k): v for k, v in sorted(statuses.items())},
+		'seconds': elapsed,
+		'requests_per_second': len(latencies) / elapsed if elapsed else None,
+		'latency_ms': {
+			'p50': percentile(latencies, 50) * 1000 if latencies else None,
+			'p90': percentile(latencies, 90) * 1000 if latencies else None,
+			'p99': percentile(latencies, 99) * 1000 if latencies else None,
+			'max': latencies[-1] * 1000 if latencies else None,
+		},
+	}
+
+## Benchmark a running server
+# @param port		Port the server listens on
+# @param decks		Amount of presentations
+# @param requests	Amount of requests per kind
+# @param concurrency	Amount of connections
+# @return		Results per kind of request
+async def bench(port, decks, requests, concurrency):
+	prefixes = ['/deck-{}/'.format(d) for d in range(decks)]
+	conn = Connection(port)
+
+	# warm up, and get the validators of the pages
+	revalidate = []
+
+	for p in prefixes:
+		for f in ('image.png', 'style.scss'):
+			await conn.get(p + f)
+
+		status, headers, _ = await conn.get(p)
+		validators = {}
+
+		if 'last-modified' in headers:
+			validators['If-Modified-Since'] = headers['last-modified']
+		if 'etag' in headers:
+			validators['If-None-Match'] = headers['etag']
+
+		revalidate.append((p, validators))
+
+	conn.close()
+
+	kinds = {
+		'page': [(p, {}) for p in prefixes],
+		'revalidate': revalidate,
+		'static': [(p + 'image.png', {}) for p in prefixes],
+		'scss': [(p + 'style.scss', {}) for p in prefixes],
+	}
+
+	return {name: await load(port, targets, requests, concurrency)
+		for name, targets in kinds.items()}
+
+## Get the commit the benchmark runs on
+def commit():
+	try:
+		return subprocess.run(['git', 'rev-parse', 'HEAD'],
+			cwd = root,
+			stdout = subprocess.PIPE,
+			stderr = subprocess.DEVNULL,
+			check = True,
+		).stdout.decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def main():
+	params = {
+		'decks': 8,
+		'slides': 50,
+		'asset_kib': 64,
+		'scss_depth': 4,
+		'requests': 2000,
+		'concurrency': 16,
+	}
+	mode = 'both'
+	port = None
+	output = None
+
+	i = 1
+	while i < len(sys.argv):
+		opt = sys.argv[i][2:].replace('-', '_')
+
+		if opt in params:
+			params[opt] = int(sys.argv[i+1])
+			i += 1
+		elif sys.argv[i] == '--mode':
+			mode = sys.argv[i+1]
+			i += 1
+		elif sys.argv[i] == '--port':
+			port = int(sys.argv[i+1])
+			i += 1
+		elif sys.argv[i] == '--output':
+			output = sys.argv[i+1]
+			i += 1
+		i += 1
+
+	port = port or free_port()
+	docroot = tempfile.mkdtemp(prefix = 'waterslide-bench-')
+
+	results = {
+		'commit': commit(),
+		'python': sys.version.split()[0],
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+		'parameters': params,
+		'results': {},
+	}
+
+	try:
+		decks = generate(docroot, params['decks'], params['slides'],
+			params['asset_kib'], params['scss_depth'])
+
+		invocations = {
+			'serve': ['serve', '-z', '-s', '-p', str(port)] + decks,
+			'manage': ['manage', '-p', str(port), docroot],
+		}
+
+		for name, args in invocations.items():
+			if mode not in (name, 'both'):
+				continue
+
+			proc = start_server(args, port)
+			loop = asyncio.new_event_loop()
+
+			try:
+				results['results'][name] = loop.run_until_complete(
+					bench(port, params['decks'], params['requests'], params['concurrency']))
+			finally:
+				loop.close()
+				proc.terminate()
+				proc.wait()
+	finally:
+		shutil.rmtree(docroot, ignore_errors = True)
+
+	text = json.dumps(results, indent = 1)
+
+	if output:
+		with open(output, 'w') as f:
+			f.write(text + '\n')
+
+	print(text)
+
+if __name__ == "__main__":
+	sys.exit(main())
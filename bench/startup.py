@@ -0,0 +1,114 @@
+#! /usr/bin/env python3
+
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Startup time regression check.
+#
+# The cheap subcommands (version, conf) must not import the serving stack
+# (aiohttp, socketio, libsass, ...), enumerate the network interfaces or
+# invoke git. This script checks that, and times a couple of invocations.
+# It exits with a non-zero status when any of the checks fail.
+#
+# usage: python3 bench/startup.py [--limit <ms>] [--runs <n>]
+
+import sys
+import os
+import time
+import json
+import subprocess
+
+root = os.path.split(os.path.dirname(os.path.abspath(__file__)))[0]
+
+## Modules which may only be imported by the serving subcommands
+heavy = ('aiohttp', 'socketio', 'sass', 'yaml', 'pytz', 'netifaces')
+
+## Invocations which should return (almost) immediately
+invocations = (
+	['version', '--btime'],
+	['conf', 'wwwdata-path'],
+	['conf', 'data-path'],
+)
+
+## Find the heavy modules imported as a side effect of importing the main module
+def imported_heavy():
+	code = '\n'.join((
+		'import sys',
+		'from waterslide import waterslide, version',
+		'version.version().btime()',
+		'print(",".join(m for m in {} if m in sys.modules))'.format(repr(heavy)),
+	))
+
+	out = subprocess.run([sys.executable, '-c', code],
+		cwd = root,
+		stdout = subprocess.PIPE,
+		check = True,
+	).stdout.decode().strip()
+
+	return [m for m in out.split(',') if m]
+
+## Best wall clock time of a command in milliseconds
+# @param cmd	Command to run
+# @param runs	Amount of runs to take the best time from
+def time_command(cmd, runs):
+	best = None
+
+	for _ in range(runs):
+		t = time.perf_counter()
+		subprocess.run(cmd,
+			cwd = root,
+			stdout = subprocess.DEVNULL,
+			check = True,
+		)
+		dt = (time.perf_counter() - t) * 1000
+		best = dt if best is None else min(best, dt)
+
+	return best
+
+## Best wall clock time of a wslide invocation in milliseconds
+# @param args	Arguments passed to the wslide script
+# @param runs	Amount of runs to take the best time from
+def time_invocation(args, runs):
+	return time_command([sys.executable, os.path.join(root, 'wslide')] + args, runs)
+
+def main():
+	limit = 250.0
+	runs = 5
+
+	i = 1
+	while i < len(sys.argv):
+		if sys.argv[i] == '--limit':
+			limit = float(sys.argv[i+1])
+			i += 1
+		elif sys.argv[i] == '--runs':
+			runs = int(sys.argv[i+1])
+			i += 1
+		i += 1
+
+	# the interpreter's own startup time is not ours to optimise, but it
+	# is useful to compare against
+	baseline = time_command([sys.executable, '-c', 'pass'], runs)
+
+	results = {
+		'heavy_imports': imported_heavy(),
+		'baseline_ms': baseline,
+		'limit_ms': limit,
+		'invocations': {
+			' '.join(a): time_invocation(a, runs) for a in invocations
+		},
+	}
+
+	failed = bool(results['heavy_imports']) or \
+		any(t > limit for t in results['invocations'].values())
+
+	results['ok'] = not failed
+	print(json.dumps(results, indent = 1))
+
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
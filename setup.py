@@ -70,7 +70,6 @@ setup(
 		'python-socketio',
 		'PyYAML',
 		'netifaces',
-		'pytz',
 	],
 	
 	entry_points={
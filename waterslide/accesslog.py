@@ -0,0 +1,181 @@
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import sys
+import json
+import time
+import random
+import asyncio
+from collections import namedtuple
+from waterslide import metrics
+
+##
+#  @defgroup accesslog Access log module
+#
+# Writing a log line to stdout for every request blocks the event loop when
+# stdout is slow (a pipe to a busy logger, for example). Instead, requests are
+# recorded in a queue, and a background task formats and writes them in
+# batches, from a thread so that a slow write doesn't hold up the loop.
+#
+# The queue is bounded: when the writer can't keep up, records are dropped and
+# counted (waterslide_access_log_dropped_total) instead of using more and more
+# memory. Successful requests can be sampled, requests which failed are always
+# logged.
+#
+# Records are formatted as plain text (the default), in the combined log
+# format, or as JSON objects, one per line.
+#
+#  @addtogroup accesslog
+#  @{
+#
+
+## Record of a request
+Record = namedtuple('Record', ('time', 'remote', 'version', 'method', 'scheme',
+	'host', 'path', 'query', 'code', 'size', 'duration', 'referer', 'agent'))
+
+dropped = metrics.Counter('waterslide_access_log_dropped_total',
+	'Access log records dropped because the queue was full')
+
+## Get the query string of a record
+def query_string(record):
+	return '?' + '&'.join('{}={}'.format(k, v) if v else k
+		for k, v in record.query.items()) if record.query else ''
+
+## Format a record as plain text
+def text(record):
+	return 'HTTP/{}.{} {} {} {}://{}{}{} {:.1f}ms {}'.format(
+		record.version[0], record.version[1], record.code, record.method,
+		record.scheme, record.host, record.path, query_string(record),
+		record.duration * 1000, '-' if record.size is None else record.size)
+
+## Format a record in the combined log format
+def combined(record):
+	return '{} - - [{}] "{} {}{} HTTP/{}.{}" {} {} "{}" "{}"'.format(
+		record.remote or '-',
+		time.strftime('%d/%b/%Y:%H:%M:%S %z', time.localtime(record.time)),
+		record.method, record.path, query_string(record),
+		record.version[0], record.version[1], record.code,
+		'-' if record.size is None else record.size,
+		record.referer or '-', record.agent or '-')
+
+## Format a record as a JSON object
+def as_json(record):
+	return json.dumps({
+		**record._asdict(),
+		'version': '{}.{}'.format(*record.version),
+		'query': dict(record.query),
+		'duration': round(record.duration * 1000, 3),
+		}, separators = (',', ':'))
+
+## Available formats, by name
+formats = {
+	'text': text,
+	'combined': combined,
+	'json': as_json,
+	}
+
+## Buffered access log
+class AccessLog():
+
+	## @param self		Object pointer
+	# @param fmt		Name of the format of the records
+	# @param sample	Fraction of the successful requests to log
+	# @param depth		Maximum amount of records waiting to be written
+	# @param interval	Time (in seconds) between writing batches
+	# @param out		File to write to
+	def __init__(self, fmt = 'text', sample = 1.0, depth = 10000, interval = .25, out = None):
+		self.conf(fmt, sample, depth, interval)
+		self.out = out
+		## Records waiting to be written
+		self.queue = []
+		self.task = None
+
+	## Configure the log
+	# @copydetails AccessLog.__init__
+	def conf(self, fmt = None, sample = None, depth = None, interval = None):
+		if fmt is not None:
+			self.format = formats[fmt]
+		if sample is not None:
+			self.sample = sample
+		if depth is not None:
+			self.depth = depth
+		if interval is not None:
+			self.interval = interval
+
+	## Record a request
+	# @param self		Object pointer
+	# @param record	Record of the request
+	#
+	# Before the background task has started (and after it has stopped),
+	# records are written immediately.
+	def add(self, record):
+		if record.code < 400 and self.sample < 1 and random.random() >= self.sample:
+			return
+
+		if self.task is None:
+			self.write([record])
+		elif len(self.queue) < self.depth:
+			self.queue.append(record)
+		else:
+			dropped.inc()
+
+	## Format and write records
+	# @param self		Object pointer
+	# @param records	List of records
+	def write(self, records):
+		out = self.out or sys.stdout
+
+		out.write(''.join(self.format(r) + '\n' for r in records))
+		out.flush()
+
+	## Write the queued records in batches, until cancelled
+	# @param self	Object pointer
+	async def run(self):
+		loop = asyncio.get_event_loop()
+
+		while True:
+			await asyncio.sleep(self.interval)
+
+			if not self.queue:
+				continue
+
+			batch, self.queue = self.queue, []
+
+			# records keep being queued while the batch is written
+			await loop.run_in_executor(None, self.write, batch)
+
+	## Start writing in the background
+	# @param self	Object pointer
+	# @param app	Web application which is starting
+	async def start(self, app):
+		self.task = asyncio.get_event_loop().create_task(self.run())
+
+	## Stop writing in the background, and write what is left
+	# @param self	Object pointer
+	# @param app	Web application which is shutting down
+	async def stop(self, app):
+		if self.task:
+			self.task.cancel()
+			self.task = None
+
+		batch, self.queue = self.queue, []
+
+		if batch:
+			self.write(batch)
+
+	## Write the log in the background while a web application runs
+	# @param self	Object pointer
+	# @param app	Web application, which hasn't started yet
+	def setup(self, app):
+		app.on_startup.append(self.start)
+		app.on_cleanup.append(self.stop)
+		return self
+
+## Access log used by the request handlers
+log = AccessLog()
+
+## @}
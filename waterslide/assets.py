@@ -0,0 +1,375 @@
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import re
+import time
+import hashlib
+import mimetypes
+import sass
+from collections import namedtuple
+from waterslide import httputils, cache, shared, metrics, timing
+
+##
+#  @defgroup assets Content addressed asset module
+#
+# The presentations in a document root often contain copies of the same files,
+# such as a theme's stylesheets, fonts and logos. Assets are identified by the
+# hash of their contents instead of their path, so identical copies are
+# compiled and kept only once.
+#
+# When assets are shared (the --share-assets option), the stylesheets and
+# scripts of the presentations are linked to by their content hash, under
+# /waterslide/assets/. All copies of an asset then have the same address, and
+# browsers only download it once for all the presentations using it. The
+# addresses in shared stylesheets (fonts, images) are rewritten to shared
+# addresses as well, since they can't be resolved relative to the stylesheet
+# anymore.
+#
+#  @addtogroup assets
+#  @{
+#
+
+## Address under which the shared assets are served
+prefix = '/waterslide/assets/'
+
+## Expression matching the urls in a stylesheet
+css_urls = re.compile(r'url\(\s*([\'"]?)([^\'")]*?)\1\s*\)')
+
+## Expression matching the imports of a sass stylesheet
+sass_imports = re.compile(r'@import\s+([^;\n]+)')
+
+## Sources of a sass stylesheet
+#
+# paths are the files it is made of (itself first) and the directories its
+# imports were looked up in, stamps their (modification time, size), key the
+# content key and mtime the latest modification time of the files
+SassSources = namedtuple('SassSources', ('paths', 'stamps', 'key', 'mtime'))
+
+## Sources of sass stylesheets, by path
+sass_sources = cache.lru(256)
+
+## Get the (modification time, size) of files
+# @param paths	Paths to the files
+# @return	Tuple of the stamps, with None for missing files
+def stamps(paths):
+	ret = []
+
+	for p in paths:
+		try:
+			st = os.stat(p)
+			ret.append((st.st_mtime_ns, st.st_size))
+		except FileNotFoundError:
+			ret.append(None)
+
+	return tuple(ret)
+
+## Get the names a sass stylesheet imports
+# @param fname	Path to the stylesheet
+# @return	List of the names, as they are written
+#
+# Imports of plain css (by their extension, url or protocol) are left to the
+# browser, and are not part of the stylesheet.
+def imported(fname):
+	with open(fname, 'r', encoding = 'utf-8') as f:
+		text = f.read()
+
+	ret = []
+
+	for m in sass_imports.finditer(text):
+		for name in m.group(1).split(','):
+			name = name.strip().strip('\'"')
+
+			if name and not (name.endswith('.css') or name.startswith(('url(', '//')) or
+			':' in name):
+				ret.append(name)
+
+	return ret
+
+## Find the file an import refers to, as libsass does
+# @param name	Name of the import
+# @param base	Directory of the importing stylesheet
+# @return	(path of the file or None, directories looked in)
+def resolve_import(name, base):
+	d, b = os.path.split(os.path.normpath(os.path.join(base, name)))
+	exts = ('',) if os.path.splitext(b)[1] in ('.scss', '.sass') else ('.scss', '.sass', '.css')
+
+	candidates = [os.path.join(d, p + b + e) for p in ('_', '') for e in exts] + \
+		[os.path.join(d, b, p + 'index' + e) for p in ('_', '') for e in ('.scss', '.sass')]
+
+	for c in candidates:
+		if os.path.isfile(c):
+			return c, (d,)
+
+	return None, (d, os.path.join(d, b))
+
+## Find the sources of a sass stylesheet
+# @param fname	Path to the stylesheet
+# @return	SassSources tuple
+#
+# The imports are followed from the stylesheet, wherever they lead. The key
+# hashes the contents of the files along with which file each import
+# resolved to, so copies of a stylesheet and its imports have the same key
+# wherever they are, and stylesheets whose imports resolve to different files
+# don't.
+def find_sources(fname):
+	files = [fname]
+	dirs = []
+	lines = []
+
+	# files are stamped before they are read, so a change made while they
+	# are read is noticed the next time
+	fstamps = [stamps(files)[0]]
+
+	i = 0
+	while i < len(files):
+		links = []
+
+		for name in imported(files[i]):
+			path, looked = resolve_import(name, os.path.dirname(files[i]))
+			dirs += [d for d in looked if d not in dirs]
+
+			if path is not None and path not in files:
+				files.append(path)
+				fstamps += stamps((path,))
+
+			links.append(str(files.index(path)) if path is not None else '-')
+
+		lines.append('{} {}'.format(httputils.file_digest(files[i]), ' '.join(links)))
+		i += 1
+
+	return SassSources(
+		paths = tuple(files + dirs),
+		stamps = tuple(fstamps) + stamps(dirs),
+		key = hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest(),
+		mtime = max(st[0] for st in fstamps if st) / 1e9,
+		)
+
+## Get the sources of a sass stylesheet
+# @param fname	Path to the stylesheet
+# @return	SassSources tuple
+#
+# The sources are only looked up again when one of the files (or the
+# directories the imports were looked up in) changed, which is checked by
+# stat-ing them. Nothing is read or hashed otherwise.
+def sources(fname):
+	entry = sass_sources.peek(fname)
+
+	if entry is None or stamps(entry.paths) != entry.stamps:
+		entry = find_sources(fname)
+		sass_sources.put(fname, entry)
+
+	return entry
+
+## Get the content key of a sass stylesheet
+# @param fname	Path to the stylesheet
+# @return	Hash of the stylesheet and the stylesheets it imports
+def sass_key(fname):
+	return sources(fname).key
+
+## Get the modification time of an asset
+# @param fname	Path to the asset
+# @return	The modification time, which for sass stylesheets is the latest
+#		one of the stylesheets it is made of
+def mtime(fname):
+	if os.path.splitext(fname)[1].lower() not in ('.scss', '.sass'):
+		return os.path.getmtime(fname)
+
+	return sources(fname).mtime
+
+## Compiled sass stylesheets, by content key
+compiled = cache.lru(64)
+
+## Compile a sass stylesheet
+# @param fname	Path to the stylesheet
+# @return	bytes-like object of the compiled, utf-8 encoded stylesheet
+#
+# Stylesheets are compiled once per content key, and the result is shared
+# with the other workers. Shared stylesheets are named after their path, so
+# compiling a new version replaces the previous one.
+def compile_sass(fname):
+	key = sass_key(fname)
+
+	def build():
+		t = time.perf_counter()
+
+		with timing.phase('sass'):
+			ret = sass.compile(filename = fname).encode('utf-8')
+
+		metrics.sass_compiles.observe(time.perf_counter() - t)
+		return ret
+
+	return compiled.get(key, lambda: shared.store.get('sass:' + os.path.abspath(fname), key, build))
+
+## Registry of the shared assets
+class Registry():
+
+	## @param self	Object pointer
+	# @param depth	Maximum amount of assets of each kind to remember
+	def __init__(self, depth = 4096):
+		## Shared names of files, and the last path they were found at
+		self.files = cache.lru(depth)
+		## Shared names of stylesheets, and their rewritten contents
+		self.styles = cache.lru(depth)
+		## (path, version) of stylesheets, and their shared names
+		self.names = cache.lru(depth)
+
+	## Get the shared address of a file
+	# @param self	Object pointer
+	# @param fname	Path to the file
+	# @return	Shared address of the file
+	def address(self, fname):
+		ext = os.path.splitext(fname)[1].lower()
+
+		if ext in ('.scss', '.sass', '.css'):
+			return prefix + self.stylesheet(fname)
+
+		name = httputils.file_digest(fname) + ext
+		self.files.put(name, fname)
+
+		# other workers look the file up by its shared name
+		shared.store.get('file:' + os.path.abspath(fname), name,
+			lambda: fname.encode('utf-8'), alias = 'asset:' + name)
+
+		return prefix + name
+
+	## Register a stylesheet
+	# @param self	Object pointer
+	# @param fname	Path to the stylesheet
+	# @return	Shared name of the stylesheet
+	def stylesheet(self, fname):
+		sass_file = os.path.splitext(fname)[1].lower() != '.css'
+		key = (fname, sass_key(fname) if sass_file else httputils.file_digest(fname))
+
+		def build():
+			if sass_file:
+				css = bytes(compile_sass(fname)).decode('utf-8')
+			else:
+				with open(fname, 'r', encoding = 'utf-8') as f:
+					css = f.read()
+
+			data = self.rewrite(css, os.path.dirname(fname)).encode('utf-8')
+			name = hashlib.sha1(data).hexdigest() + '.css'
+
+			# other workers may get the request for it
+			self.styles.put(name, shared.store.get('style:' + os.path.abspath(fname), name,
+				lambda: data, alias = 'asset:' + name))
+			return name
+
+		name = self.names.get(key, build)
+
+		# the contents may have been evicted in the mean time
+		if self.styles.peek(name) is None:
+			name = build()
+			self.names.put(key, name)
+
+		return name
+
+	## Rewrite the relative addresses in a stylesheet to shared addresses
+	# @param self	Object pointer
+	# @param css	The stylesheet
+	# @param base	Directory the addresses are relative to
+	def rewrite(self, css, base):
+
+		def sub(m):
+			url = m.group(2)
+
+			if url.startswith('/') or ':' in url or '//' in url:
+				return m.group(0)
+
+			# keep the fragment, for fonts ('font.eot?#iefix') and svgs
+			path, sep, rest = url.partition('#')
+			fname = os.path.normpath(os.path.join(base, path.split('?')[0]))
+
+			if not os.path.isfile(fname):
+				return m.group(0)
+
+			return 'url("{}{}{}")'.format(self.address(fname), sep, rest)
+
+		return css_urls.sub(sub, css)
+
+	## Register the route serving the shared assets
+	# @param self	Object pointer
+	# @param app	app to attach to
+	def register(self, app):
+		app.router.add_route('GET', prefix + '{name}', self.handle)
+		app.router.add_route('HEAD', prefix + '{name}', self.handle)
+		return self
+
+	## Handle a request for a shared asset
+	# @param self		Object pointer
+	# @param request	Request to be handled
+	#
+	# Shared assets never change, so they can be cached indefinitely.
+	@httputils.aio_translate(rewrite = lambda r:r.match_info['name'],
+					logger = httputils.log_request)
+	def handle(self, request):
+		name = request.url.path
+		etag = '"{}"'.format(os.path.splitext(name)[0])
+
+		headers = {
+			'Cache-Control': 'public, max-age=31536000, immutable',
+			'ETag': etag,
+			}
+
+		style = self.styles.peek(name)
+		fname = self.files.peek(name)
+
+		# registered by another worker
+		if style is None and fname is None:
+			found = shared.store.lookup_alias('asset:' + name)
+
+			if found is not None and name.endswith('.css'):
+				style = found
+			elif found is not None:
+				fname = bytes(found).decode('utf-8')
+
+		# the file may have changed since it was registered
+		if style is None and not (fname and os.path.isfile(fname) and
+		httputils.file_digest(fname) == etag[1:-1]):
+			return httputils.HTTP_Response(
+				code = 404,
+				headers = {},
+				body = "404 Not Found:\n{}".format(name)
+				)
+
+		if httputils.etag_matches(request.headers.get('If-None-Match', ''), etag):
+			return httputils.HTTP_Response(code = 304, headers = headers, body = None)
+
+		if style is not None:
+			response = httputils.HTTP_Response(
+				code = 200,
+				headers = {**headers, 'Content-type': 'text/css'},
+				body = None
+				)
+
+			if request.method == 'HEAD':
+				return httputils.head_response(response, len(style))
+
+			return response._replace(body = style)
+
+		response = httputils.HTTP_Response(
+			code = 200,
+			headers = {**headers,
+				'Content-type': mimetypes.guess_type(name)[0] or 'application/octet-stream'},
+			body = None
+			)
+
+		if request.method == 'HEAD':
+			return httputils.head_response(response, os.path.getsize(fname))
+
+		return response._replace(body = httputils.static_files.get(fname))
+
+## Registry used by the presentations and the server
+registry = Registry()
+
+metrics.register_cache('sass', compiled.status, lambda: compiled.cache)
+metrics.register_cache('sass_sources', sass_sources.status, lambda: sass_sources.cache)
+metrics.register_cache('asset_files', registry.files.status, lambda: registry.files.cache)
+metrics.register_cache('asset_styles', registry.styles.status, lambda: registry.styles.cache)
+
+## @}
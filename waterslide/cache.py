@@ -5,6 +5,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import os
 import collections
 
 ##
@@ -14,7 +15,13 @@ import collections
 #  @{
 #
 
-CStats = collections.namedtuple('CStats', ['hits', 'misses', 'csize'])
+CStats = collections.namedtuple('CStats', ['hits', 'misses', 'csize', 'evictions'])
+
+## Status of a filecache
+FStats = collections.namedtuple('FStats', ['hits', 'misses', 'entries', 'resident', 'budget', 'evictions'])
+
+## Sentinel for keys which are not in a cache
+missing = object()
 
 ## Class used to maintain state in the caching decorator
 #
@@ -27,6 +34,8 @@ class cache_state():
 	hits = 0
 	## Cache misses
 	misses = 0
+	## Entries evicted from the cache
+	evictions = 0
 	## Maximum cache size
 	depth = 32
 	## The cache itself
@@ -35,6 +44,207 @@ class cache_state():
 	# It defaults to true
 	valid = lambda k,v: True
 
+## Bounded least recently used mapping
+#
+# For caches which are not keyed by a function's argument, or which need to be
+# kept per object instead of per function
+class lru():
+
+	def __init__(self, depth = 32):
+		## Maximum amount of entries
+		self.depth = depth
+		## Cache hits
+		self.hits = 0
+		## Cache misses
+		self.misses = 0
+		## Entries evicted from the cache
+		self.evictions = 0
+		self.cache = collections.OrderedDict()
+
+	## Get an entry, or compute and store it if it isn't in the cache
+	# @param self	Object pointer
+	# @param key	Key of the entry
+	# @param func	Callable without arguments which computes the entry
+	def get(self, key, func):
+		ret = self.cache.get(key, missing)
+
+		if ret is not missing:
+			self.cache.move_to_end(key)
+			self.hits += 1
+			return ret
+
+		ret = self.cache[key] = func()
+		self.misses += 1
+
+		while len(self.cache) > self.depth:
+			self.cache.popitem(False)
+			self.evictions += 1
+
+		return ret
+
+	## Get an entry without computing it
+	# @param self		Object pointer
+	# @param key		Key of the entry
+	# @param default	Value returned when the entry isn't cached
+	def peek(self, key, default = None):
+		ret = self.cache.get(key, missing)
+
+		if ret is missing:
+			return default
+
+		self.cache.move_to_end(key)
+		return ret
+
+	## Store an entry, replacing the current one
+	def put(self, key, value):
+		self.cache[key] = value
+		self.cache.move_to_end(key)
+
+		while len(self.cache) > self.depth:
+			self.cache.popitem(False)
+			self.evictions += 1
+
+	## Remove an entry, if it is in the cache
+	def drop(self, key):
+		self.cache.pop(key, None)
+
+	## Remove all entries
+	def clear(self):
+		self.cache.clear()
+
+	## Get the cache's current status
+	def status(self):
+		return CStats(self.hits, self.misses, len(self.cache), self.evictions)
+
+## Bounded cache of file contents
+#
+# Files are kept by path, and are loaded again when their modification time or
+# size changed. The cache holds at most 'budget' bytes, and evicts the least
+# recently used files first.
+#
+# Files are read into memory. They can be truncated while a response is sent
+# from them (by an editor or rsync), which would kill the process (SIGBUS) if
+# they were memory mapped instead.
+#
+# When the cache is given an 'identify' callable (which returns a content hash
+# of the contents read), files with identical contents share one buffer, and
+# only count once against the budget.
+#
+# Evicted buffers are not closed, but dropped: responses which are still being
+# sent from them keep them alive until they are done.
+class filecache():
+
+	## @param self		Object pointer
+	# @param budget		Maximum amount of bytes to keep
+	# @param identify	Callable returning the content hash of a file,
+	#			from its path, stat result and contents, or None
+	#			to keep each path separately
+	def __init__(self, budget = 32 << 20, identify = None):
+		## Maximum amount of bytes to keep
+		self.budget = budget
+		## Callable identifying the contents of a file
+		self.identify = identify
+		## Amount of bytes currently kept
+		self.resident = 0
+		## Cache hits
+		self.hits = 0
+		## Cache misses
+		self.misses = 0
+		## Files evicted from the cache
+		self.evictions = 0
+		# path -> (mtime, size, content key)
+		self.cache = collections.OrderedDict()
+		# content key -> [buffer, amount of paths using it]
+		self.buffers = {}
+
+	## Configure the cache after initialisation
+	# @param budget	New byte budget. If not set, keep the old setting
+	def conf(self, budget = None):
+		if budget is not None:
+			self.budget = budget
+			self.evict()
+
+	## Get the contents of a file
+	# @param self	Object pointer
+	# @param path	Path to the file
+	# @return	memoryview of the contents of the file
+	def get(self, path):
+		st = os.stat(path)
+		entry = self.cache.get(path)
+
+		if entry and entry[:2] == (st.st_mtime_ns, st.st_size):
+			self.cache.move_to_end(path)
+			self.hits += 1
+			return memoryview(self.buffers[entry[2]][0])
+
+		self.misses += 1
+
+		if entry:
+			self.drop(path)
+
+		with open(path, 'rb') as f:
+			# the file may have changed since the stat
+			st = os.fstat(f.fileno())
+			data = f.read()
+
+		# the contents are identified as they were read
+		key = self.identify(path, st, data) if self.identify else path
+		shared = self.buffers.get(key)
+
+		# another path with the same contents is already kept
+		if shared:
+			self.cache[path] = (st.st_mtime_ns, st.st_size, key)
+			shared[1] += 1
+			return memoryview(shared[0])
+
+		# files which would take up most of the budget are not kept
+		if st.st_size <= self.budget // 4:
+			self.cache[path] = (st.st_mtime_ns, st.st_size, key)
+			self.buffers[key] = [data, 1]
+			self.resident += st.st_size
+			self.evict()
+
+		return memoryview(data)
+
+	## Remove a file from the cache
+	def drop(self, path):
+		entry = self.cache.pop(path, None)
+
+		if entry:
+			self.release(entry)
+
+	## Release the buffer of a removed entry, when no other path uses it
+	def release(self, entry):
+		shared = self.buffers[entry[2]]
+		shared[1] -= 1
+
+		if shared[1] == 0:
+			del self.buffers[entry[2]]
+			self.resident -= entry[1]
+
+	## Evict the least recently used files until the cache is within budget
+	def evict(self):
+		while self.resident > self.budget and self.cache:
+			self.release(self.cache.popitem(False)[1])
+			self.evictions += 1
+
+	## Remove all files
+	def clear(self):
+		self.cache.clear()
+		self.buffers.clear()
+		self.resident = 0
+
+	## Ratio of the requests which were served from the cache
+	@property
+	def ratio(self):
+		total = self.hits + self.misses
+		return self.hits / total if total else 0.0
+
+	## Get the cache's current status
+	def status(self):
+		return FStats(self.hits, self.misses, len(self.cache), self.resident,
+			self.budget, self.evictions)
+
 ## Caching decorator initialisation function
 # @param depth		Cache depth
 # @param valid		Callable used to determine if the cached object is still valid
@@ -42,21 +252,30 @@ def cache(depth = 32, valid = lambda k,v: True):
 	
 	## Helper function to bring the object cached by key to the top of
 	# the cache
+	#
+	# The cache may be used from multiple threads (e.g. while loading
+	# presentations), so the key might have been evicted in the mean time
 	def touch(cache, key):
-		val = cache.get(key)
-		del cache[key]
-		cache[key] = val
+		try:
+			cache.move_to_end(key)
+		except KeyError:
+			pass
 	
 	## Caching initialisation function
 	# @param func	Function to cache the output from
 	def boot(func):
 		state = cache_state()
+		state.cache = collections.OrderedDict()
 		state.depth = depth
 		state.valid = valid
 
 		## Get the cache's current status
 		def status():
-			return CStats(state.hits, state.misses, len(state.cache))
+			return CStats(state.hits, state.misses, len(state.cache), state.evictions)
+
+		## Get the cached objects, by key
+		def contents():
+			return state.cache
 
 		## Purge the cache, reset stats to zero
 		# @copydetails conf
@@ -64,7 +283,8 @@ def cache(depth = 32, valid = lambda k,v: True):
 			state.cache = collections.OrderedDict()
 			state.misses = 0
 			state.hits = 0
-			conf(depth, stale)
+			state.evictions = 0
+			conf(depth, valid)
 
 		## Configure cache after initialisation
 		# @param depth	New cache depth. If not set, keep the old setting
@@ -82,13 +302,11 @@ def cache(depth = 32, valid = lambda k,v: True):
 		# and functions
 		def decorator(*args, **kwargs):
 
-			ret = None
 			key = args[-1]
+			ret = state.cache.get(key, missing)
 			
-			
-			if key in state.cache and state.valid(key, state.cache[key]):
+			if ret is not missing and state.valid(key, ret):
 				touch(state.cache, key)
-				ret = state.cache[key]
 				state.hits += 1
 			else:
 				ret = func(*args, **kwargs)
@@ -96,12 +314,17 @@ def cache(depth = 32, valid = lambda k,v: True):
 				state.misses += 1
 
 			while len(state.cache) > state.depth:
-				state.cache.popitem(False)
+				try:
+					state.cache.popitem(False)
+					state.evictions += 1
+				except KeyError:
+					break
 
 			return ret
 		
 		# bind function references
 		decorator.status = status
+		decorator.contents = contents
 		decorator.purge	 = purge
 		decorator.conf   = conf
 		
@@ -0,0 +1,802 @@
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from sys import argv
+import os
+import re
+import io
+import json
+import base64
+import mimetypes
+import gzip
+import time
+import shutil
+import hashlib
+import posixpath
+from itertools import repeat
+from collections import namedtuple
+from concurrent import futures
+from waterslide import presentation, httputils, assets, slides
+
+##
+#  @defgroup export Static export module
+#
+# Exports presentations to plain files, which can be served by any webserver
+# (or CDN) without WaterSlide running in front of it.
+#
+# Each presentation is written to its own directory in the output directory,
+# named after its slug. Its html is rendered by Presentation.get_html, SCSS
+# stylesheets are compiled, and the configured stylesheets and scripts get a
+# fingerprinted (content hash in the name) filename, so they can be cached
+# indefinitely. Text files are also written gzip compressed next to the
+# original (for NginX's gzip_static, for example). WaterSlide's own web
+# resources go into the 'waterslide' directory.
+#
+# Only the files a presentation refers to are exported: its stylesheets and
+# scripts, the files its slides, plugins and favicon refer to, and the files
+# those stylesheets and external markdown refer to in turn. Files which are
+# only reached some other way (a script building their address, for example)
+# are exported with --all-files.
+#
+# Exports are incremental: a manifest of the content hash of each output is
+# kept in the output directory, and outputs which didn't change are not
+# written again.
+#
+# Alternatively, each presentation is exported to a single, self-contained
+# html file. Its stylesheets, scripts and the files its slides refer to are
+# inlined, with Reveal.js taken from a local copy of its repository. Files are
+# streamed into the html file, so large media is never held in memory.
+#
+#  @addtogroup export
+#  @{
+#
+
+## Export configuration
+#
+# output is the output directory, provider the Reveal.js provider override
+# (or None), hardlink whether to hardlink files instead of copying them, force
+# whether to write all the outputs regardless of the manifest, single whether
+# to export to single files, local the path to a local Reveal.js repository
+# (or None) and all_files whether to export all the files of a presentation,
+# instead of the ones it refers to
+ExportConf = namedtuple('ExportConf',
+	('output', 'provider', 'hardlink', 'force', 'single', 'local', 'all_files'))
+
+## Result of exporting a presentation
+#
+# external contains the addresses which could not be inlined in a single file
+# export, and are linked to as they are
+ExportResult = namedtuple('ExportResult',
+	('path', 'slug', 'written', 'skipped', 'removed', 'time', 'error', 'external'))
+
+## Name of the manifest in each output directory
+manifest_name = '.waterslide-export.json'
+
+## Extensions of the files which are precompressed
+compressible = ('.html', '.css', '.js', '.json', '.svg', '.txt', '.xml', '.md')
+
+## Files in a presentation which are never exported. The server configuration
+# file can contain credentials
+skipped_files = ('index.html', 'conf.yaml')
+
+## Read size used while base64 encoding files. A multiple of 3, so the
+# encoded blocks can be concatenated
+b64blocksize = 3 << 14
+
+## Directory containing WaterSlide's own web resources
+resources = os.path.join(os.path.split(__file__)[0], 'web-resources')
+
+## Insert a content hash into a filename
+# @param path	Path of the file
+# @param digest	Content hash of the file
+# @param ext	Extension to use instead of the original one
+def fingerprint(path, digest, ext = None):
+	base, e = os.path.splitext(path)
+	return '{}.{}{}'.format(base, digest[:12], ext if ext is not None else e)
+
+## Normalise a relative url, to be used as a key
+# @return	The normalised url, or None when it is not a relative url
+def relative(url):
+	# fragments refer to the page itself
+	if not url or url.startswith(('/', '#')) or '//' in url or ':' in url or \
+	slides.css_colours.match(url):
+		return None
+
+	return posixpath.normpath(url)
+
+## Expression matching the attributes of a slide which link to files
+page_links = re.compile(r'\s(?:href|data-markdown)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.I)
+
+## Expression matching the addresses of the links and images in markdown
+markdown_links = re.compile(r'\]\(\s*<?([^)\s>]+)')
+
+## Find the files a presentation refers to
+# @param p	Presentation
+# @return	Set of the files, as normalised urls relative to the presentation
+#
+# Stylesheets (compiled, when SCSS) and external markdown are searched for
+# the files they refer to in turn, relative to where they are.
+def references(p):
+	found = set()
+	pending = []
+
+	def add(url, base = ''):
+		rel = relative(url.split('?')[0].split('#')[0])
+		rel = rel and posixpath.normpath(posixpath.join(base, rel))
+
+		# files outside of the presentation can't be exported with it
+		if not rel or rel in found or rel.startswith('../') or rel in skipped_files or \
+		not os.path.isfile(os.path.join(p.path, rel)):
+			return
+
+		found.add(rel)
+		pending.append(rel)
+
+	for a in (p.config.get('styles') or []) + (p.config.get('scripts') or []):
+		add(a)
+
+	for urls in p.asset_manifest():
+		for url in urls:
+			add(url)
+
+	for m in page_links.finditer(''.join(s.html for s in p.deck.slides)):
+		add(m.group(1) if m.group(1) is not None else m.group(2))
+
+	for k in p.dependencies():
+		for m in presentation.plugin_src.finditer(k):
+			add(m.group(3))
+
+	add(p.config.get('favicon') or '')
+
+	while pending:
+		rel = pending.pop()
+		fname = os.path.join(p.path, rel)
+		ext = os.path.splitext(rel)[1].lower()
+		base = posixpath.dirname(rel)
+
+		if ext in ('.scss', '.sass', '.css'):
+			if ext == '.css':
+				with open(fname, 'r', encoding = 'utf-8') as f:
+					css = f.read()
+			else:
+				css = p.compile_sass(fname)
+
+			for m in assets.css_urls.finditer(css):
+				add(m.group(2), base)
+
+		elif ext in ('.md', '.markdown'):
+			with open(fname, 'r', encoding = 'utf-8') as f:
+				text = f.read()
+
+			for url in slides.assets(text):
+				add(url, base)
+
+			for m in page_links.finditer(text):
+				add(m.group(1) if m.group(1) is not None else m.group(2), base)
+
+			for m in markdown_links.finditer(text):
+				add(m.group(1), base)
+
+	return found
+
+## Presentation which links its stylesheets and scripts to exported files
+class ExportPresentation(presentation.Presentation):
+
+	## Map of the configured (normalised) addresses to exported ones
+	resolved = {}
+
+	def resolve(self, address):
+		key = relative(address)
+		return self.resolved.get(key, address) if key else address
+
+## Expression matching the markers of the addresses to inline in a single file
+inline_markers = re.compile('\x01(css|js|uri):([^\x01]*)\x01')
+
+## Expression matching the attributes of a slide which reference files
+slide_assets = re.compile(
+	r'(\s(?:src|data-src|poster|data-background-image|data-background-video|data-background)'
+	r'\s*=\s*)(?:"([^"]*)"|\'([^\']*)\')', re.I)
+
+## Get the marker of an address to inline
+# @param kind		'css', 'js' or 'uri' (data: uri)
+# @param address	Address to inline
+def inline(kind, address):
+	return '\x01{}:{}\x01'.format(kind, address)
+
+## Presentation which marks its stylesheets, scripts and files for inlining
+class SingleFilePresentation(presentation.Presentation):
+
+	## Path to the local Reveal.js repository
+	local = None
+
+	def link_stylesheet(self, address):
+		return inline('css', address)
+
+	def link_javascript(self, address):
+		return inline('js', address)
+
+	@property
+	def misc_head_links(self):
+		return	"<link rel=\"shortcut icon\" href=\"{}\" />" \
+			.format(inline('uri', self.config.get('favicon', '/waterslide/logo.png')))
+
+	## Everything is inlined, so there is nothing to load lazily or prefetch
+	def media_conf(self):
+		return None
+
+	def render_slide(self, slide):
+		def sub(m):
+			url = m.group(2) if m.group(2) is not None else m.group(3)
+
+			if not slides.is_asset(url) or not relative(url):
+				return m.group(0)
+
+			return '{}"{}"'.format(m.group(1), inline('uri', url))
+
+		return slide_assets.sub(sub, slide.html)
+
+	def dependencies(self, multiplex = False):
+		return [presentation.plugin_src.sub(lambda m: m.group(1) + m.group(2) +
+				inline('uri', m.group(3)) + m.group(2), k)
+			for k in super().dependencies(multiplex)]
+
+	## Find the file an address refers to
+	# @param self		Object pointer
+	# @param address	Address as it is linked in the page
+	# @return		Path of the file, or None if there is no such file
+	def source(self, address):
+		address = address.split('?')[0].split('#')[0]
+		reveal = self.providers['local'] + '/'
+
+		if self.local and address.startswith(reveal):
+			fname = os.path.join(self.local, address[len(reveal):])
+		elif address.startswith('/waterslide/'):
+			fname = os.path.join(resources, address[len('/waterslide/'):])
+		elif relative(address):
+			fname = os.path.join(self.path, relative(address))
+		else:
+			return None
+
+		return fname if os.path.isfile(fname) else None
+
+## Writes a single file export, inlining the marked addresses
+class Inliner():
+
+	## @param self	Object pointer
+	# @param p	SingleFilePresentation to export
+	# @param out	Binary file to write to
+	def __init__(self, p, out):
+		self.p = p
+		self.out = out
+		## Addresses which couldn't be inlined
+		self.external = []
+
+	## Write the page
+	# @param self	Object pointer
+	# @param html	Page, as produced by SingleFilePresentation.get_html
+	def page(self, html):
+		parts = inline_markers.split(html)
+
+		# the split alternates between text and (kind, address) pairs
+		for i in range(0, len(parts), 3):
+			self.out.write(parts[i].encode('utf-8'))
+
+			if i + 2 < len(parts):
+				self.insert(parts[i+1], parts[i+2])
+
+	## Write an inlined address
+	# @param self		Object pointer
+	# @param kind		Kind of the marker ('css', 'js' or 'uri')
+	# @param address	Address to inline
+	def insert(self, kind, address):
+		fname = self.p.source(address)
+
+		if not fname:
+			if address not in self.external:
+				self.external.append(address)
+
+			# link to it as the server would
+			if kind == 'css':
+				address = presentation.Presentation.link_stylesheet(self.p, address)
+			elif kind == 'js':
+				address = presentation.Presentation.link_javascript(self.p, address)
+
+			self.out.write(address.encode('utf-8'))
+
+		elif kind == 'css':
+			if os.path.splitext(fname)[1] in ('.scss', '.sass'):
+				css = self.p.compile_sass(fname)
+			else:
+				with open(fname, 'r', encoding = 'utf-8') as f:
+					css = f.read()
+
+			self.out.write(b'<style>')
+			self.stylesheet(css, os.path.dirname(fname), self.out)
+			self.out.write(b'</style>')
+
+		elif kind == 'js':
+			with open(fname, 'r', encoding = 'utf-8') as f:
+				js = f.read()
+
+			# the script may not end the element it is in
+			js = re.sub(r'</(script)', r'<\\/\1', js, flags = re.I)
+
+			self.out.write(b'<script>')
+			self.out.write(js.encode('utf-8'))
+			self.out.write(b'</script>')
+
+		else:
+			self.data_uri(fname, self.out)
+
+	## Write a stylesheet, with the files it refers to inlined
+	# @param self	Object pointer
+	# @param css	The stylesheet
+	# @param base	Directory relative urls are resolved against
+	# @param out	Binary file to write to
+	# @param depth	Amount of imports the stylesheet is nested in
+	#
+	# Imported stylesheets are inlined as data: uris themselves, so the
+	# order of the imports doesn't change.
+	def stylesheet(self, css, base, out, depth = 0):
+		pos = 0
+
+		for m in assets.css_urls.finditer(css):
+			url = relative(m.group(2).split('?')[0].split('#')[0])
+			fname = url and os.path.join(base, url)
+
+			if not fname or not os.path.isfile(fname):
+				continue
+
+			out.write(css[pos:m.start()].encode('utf-8'))
+			out.write(b'url(')
+
+			if os.path.splitext(fname)[1] == '.css' and depth < 8:
+				with open(fname, 'r', encoding = 'utf-8') as f:
+					imported = io.BytesIO()
+					self.stylesheet(f.read(), os.path.dirname(fname), imported, depth + 1)
+
+				out.write(b'data:text/css;base64,')
+				out.write(base64.b64encode(imported.getvalue()))
+			else:
+				self.data_uri(fname, out)
+
+			out.write(b')')
+			pos = m.end()
+
+		out.write(css[pos:].encode('utf-8'))
+
+	## Write a file as a data: uri, streaming it
+	# @param self	Object pointer
+	# @param fname	File to write
+	# @param out	Binary file to write to
+	def data_uri(self, fname, out):
+		mime = mimetypes.guess_type(fname)[0] or 'application/octet-stream'
+
+		out.write('data:{};base64,'.format(mime).encode('utf-8'))
+
+		with open(fname, 'rb') as f:
+			for block in iter(lambda: f.read(b64blocksize), b''):
+				out.write(base64.b64encode(block))
+
+## Writes the outputs of an export to a directory, incrementally
+class Output():
+
+	## @param self		Object pointer
+	# @param directory	Output directory
+	# @param econf		ExportConf tuple
+	def __init__(self, directory, econf):
+		self.directory = directory
+		self.econf = econf
+
+		self.written = 0
+		self.skipped = 0
+		self.removed = 0
+
+		## Content hashes of the outputs of the last export
+		self.old = {}
+		## Content hashes of the outputs of this export
+		self.new = {}
+
+		try:
+			with open(os.path.join(directory, manifest_name), 'r') as f:
+				self.old = json.load(f)
+		except (OSError, ValueError):
+			pass
+
+	## Check whether an output is the same as during the last export
+	# @param self	Object pointer
+	# @param rel	Path of the output, relative to the output directory
+	# @param digest	Content hash of the output
+	def unchanged(self, rel, digest):
+		self.new[rel] = digest
+
+		if not self.econf.force and self.old.get(rel) == digest and \
+		os.path.exists(os.path.join(self.directory, rel)):
+			self.skipped += 1
+			return True
+
+		return False
+
+	## Get the absolute path of an output, creating its directory
+	def target(self, rel):
+		fname = os.path.join(self.directory, rel)
+		os.makedirs(os.path.dirname(fname), exist_ok = True)
+		return fname
+
+	## Write data to an output, atomically
+	def dump(self, rel, data):
+		fname = self.target(rel)
+
+		with open(fname + '.tmp', 'wb') as f:
+			f.write(data)
+
+		os.replace(fname + '.tmp', fname)
+		self.written += 1
+
+	## Write the compressed version of an output, when worth it
+	# @param self	Object pointer
+	# @param rel	Path of the (uncompressed) output
+	# @param data	Callable returning the content of the output, which is
+	#		only called when the compressed version has to be written
+	# @param digest	Content hash of the output
+	def compress(self, rel, data, digest):
+		if os.path.splitext(rel)[1] not in compressible:
+			return
+
+		gz = rel + '.gz'
+		old = self.old.get(gz)
+
+		# a '-' marks outputs for which compressing wasn't worth it
+		if not self.econf.force and old in (digest, '-' + digest) and \
+		(old[0] == '-' or os.path.exists(os.path.join(self.directory, gz))):
+			self.new[gz] = old
+			self.skipped += 1
+			return
+
+		data = data()
+		z = gzip.compress(data, 9, mtime = 0)
+
+		if len(z) < len(data):
+			self.new[gz] = digest
+			self.dump(gz, z)
+		else:
+			self.new[gz] = '-' + digest
+
+			if os.path.exists(os.path.join(self.directory, gz)):
+				os.remove(os.path.join(self.directory, gz))
+
+	## Write an output
+	# @param self	Object pointer
+	# @param rel	Path of the output, relative to the output directory
+	# @param data	Content of the output (bytes)
+	def write(self, rel, data):
+		digest = hashlib.sha1(data).hexdigest()
+
+		if not self.unchanged(rel, digest):
+			self.dump(rel, data)
+
+		self.compress(rel, lambda: data, digest)
+
+	## Copy (or hardlink) a file to an output
+	# @param self	Object pointer
+	# @param rel	Path of the output, relative to the output directory
+	# @param src	Source file
+	# @param digest	Content hash of the source file
+	def copy(self, rel, src, digest):
+
+		if not self.unchanged(rel, digest):
+			fname = self.target(rel)
+
+			if os.path.lexists(fname):
+				os.remove(fname)
+
+			try:
+				if not self.econf.hardlink:
+					raise OSError
+				os.link(src, fname)
+			# not requested, or not possible (e.g. across file systems)
+			except OSError:
+				shutil.copyfile(src, fname)
+
+			self.written += 1
+
+		def read():
+			with open(src, 'rb') as f:
+				return f.read()
+
+		self.compress(rel, read, digest)
+
+	## Remove the outputs of the last export which are no longer there, and
+	# write the manifest
+	def finish(self):
+		for rel in set(self.old) - set(self.new):
+			try:
+				os.remove(os.path.join(self.directory, rel))
+				self.removed += 1
+			except OSError:
+				pass
+
+		os.makedirs(self.directory, exist_ok = True)
+
+		with open(os.path.join(self.directory, manifest_name), 'w') as f:
+			json.dump(self.new, f, indent = 0, sort_keys = True)
+
+## List the files of a directory recursively
+# @param root	Directory to list
+# @param skip	Absolute paths of directories to skip
+# @return	Generator of the paths of the files, relative to root
+#
+# Hidden files and directories are skipped
+def walk(root, skip = ()):
+	for d, dirs, files in os.walk(root):
+		dirs[:] = [i for i in dirs if not i.startswith('.') and
+				os.path.realpath(os.path.join(d, i)) not in skip]
+
+		for f in files:
+			if not f.startswith('.'):
+				yield os.path.relpath(os.path.join(d, f), root)
+
+## Export a presentation
+# @param path	Path to the presentation
+# @param econf	ExportConf tuple
+# @return	ExportResult tuple
+#
+# Runs in a worker process
+def export_presentation(path, econf):
+	t = time.perf_counter()
+
+	p = ExportPresentation(path, presentation.PConf(provider = econf.provider))
+
+	if not p.isreal:
+		return ExportResult(path, None, 0, 0, 0, time.perf_counter() - t,
+			str(p.import_error or 'not a presentation'), ())
+
+	slug = os.path.split(p.path)[-1]
+	out = Output(os.path.join(econf.output, slug), econf)
+
+	# the stylesheets and scripts the presentation links to itself
+	linked = set(filter(None, (relative(a) for a in
+		(p.config.get('styles') or []) + (p.config.get('scripts') or []))))
+
+	resolved = {}
+
+	try:
+		if econf.all_files:
+			urls = [rel.replace(os.sep, '/') for rel in
+				walk(p.path, skip = (os.path.realpath(econf.output),))
+				if rel not in skipped_files]
+		else:
+			urls = sorted(references(p))
+
+		for url in urls:
+
+			src = os.path.join(p.path, url)
+			ext = os.path.splitext(url)[1]
+
+			if ext in ('.scss', '.sass'):
+				# partials are only compiled as part of other stylesheets
+				if econf.all_files and posixpath.basename(url).startswith('_'):
+					continue
+
+				css = p.compile_sass(src).encode('utf-8')
+				target = fingerprint(url, hashlib.sha1(css).hexdigest(), '.css')
+				out.write(target, css)
+				resolved[url] = target
+
+			elif url in linked:
+				digest = httputils.file_digest(src)
+				target = fingerprint(url, digest)
+				out.copy(target, src, digest)
+				resolved[url] = target
+
+			else:
+				out.copy(url, src, httputils.file_digest(src))
+
+		p.resolved = resolved
+		out.write('index.html', p.get_html().encode('utf-8'))
+		out.finish()
+
+	except Exception as e:
+		return ExportResult(path, slug, out.written, out.skipped, out.removed,
+			time.perf_counter() - t, '{}: {}'.format(type(e).__name__, e), ())
+
+	return ExportResult(path, slug, out.written, out.skipped, out.removed,
+		time.perf_counter() - t, None, ())
+
+## Export a presentation to a single html file
+# @param path	Path to the presentation
+# @param econf	ExportConf tuple
+# @return	ExportResult tuple
+#
+# Runs in a worker process. Single files are always written, as finding out
+# whether they changed would mean reading all the files they inline.
+def export_single(path, econf):
+	t = time.perf_counter()
+
+	# Reveal.js is linked to the local provider when it can be inlined
+	p = SingleFilePresentation(path, presentation.PConf(
+		provider = 'local' if econf.local else econf.provider))
+	p.local = econf.local
+
+	if not p.isreal:
+		return ExportResult(path, None, 0, 0, 0, time.perf_counter() - t,
+			str(p.import_error or 'not a presentation'), ())
+
+	slug = os.path.split(p.path)[-1]
+	fname = os.path.join(econf.output, slug + '.html')
+
+	inliner = None
+
+	try:
+		with open(fname + '.tmp', 'wb') as f:
+			inliner = Inliner(p, f)
+			inliner.page(p.get_html())
+
+		os.replace(fname + '.tmp', fname)
+
+	except Exception as e:
+		if os.path.exists(fname + '.tmp'):
+			os.remove(fname + '.tmp')
+
+		return ExportResult(path, slug, 0, 0, 0, time.perf_counter() - t,
+			'{}: {}'.format(type(e).__name__, e), ())
+
+	return ExportResult(path, slug, 1, 0, 0, time.perf_counter() - t, None,
+		tuple(inliner.external))
+
+## Export WaterSlide's own web resources
+# @param econf	ExportConf tuple
+#
+# These are referred to by absolute paths (/waterslide/...), which means that
+# the output directory should be the document root of the webserver
+def export_resources(econf):
+	out = Output(os.path.join(econf.output, 'waterslide'), econf)
+
+	for rel in walk(resources):
+		fname = os.path.join(resources, rel)
+		out.copy(rel.replace(os.sep, '/'), fname, httputils.file_digest(fname))
+
+	out.finish()
+
+## Export subcommand
+# @param argn	Argument where "Main" stopped parsing
+def export(argn):
+
+	helptext = \
+'''Export subcommand: Export presentations to static files
+
+Usage:
+export [options] -o <output directory> [presentations]
+
+Each presentation is exported to the directory named after it in the output
+directory. WaterSlide's own resources are exported into the 'waterslide'
+directory, so the output directory should be served as the document root.
+Only the files a presentation refers to are exported (its stylesheets and
+scripts, the files its slides refer to and the files those refer to in turn).
+
+With --single-file, each presentation is exported to a single html file named
+after it instead, with its stylesheets, scripts and media inlined. Reveal.js is
+inlined too when a local copy of its repository is passed with --local,
+otherwise it is linked to the configured provider.
+
+Options:
+-o, --output <dir>      Directory to export to (required)
+-j, --jobs <n>          Amount of presentations to export in parallel
+                        (defaults to the amount of processors)
+-p, --provider <prov>   Override all configured presentation providers
+--hardlink              Hardlink files instead of copying them, where possible
+-f, --force             Write all outputs, even when they did not change
+-s, --single-file       Export each presentation to a single html file
+-l, --local <dir>       Local Reveal.js repository to inline in single files
+-a, --all-files         Export all the files of the presentations, instead of
+                        the ones they refer to
+-z, --silent            Only report errors
+-h, --help              Show this helptext
+'''
+
+	output = None
+	provider = None
+	hardlink = False
+	force = False
+	single = False
+	local = None
+	all_files = False
+	jobs = None
+	verbose = 1
+	paths = []
+
+	i = argn + 1
+	while i < len(argv):
+		if argv[i] in ('-o', '--output'):
+			output = argv[i+1]
+			i += 1
+		elif argv[i] in ('-j', '--jobs'):
+			jobs = int(argv[i+1])
+			i += 1
+		elif argv[i] in ('-p', '--provider'):
+			provider = argv[i+1]
+			i += 1
+		elif argv[i] == '--hardlink':
+			hardlink = True
+		elif argv[i] in ('-f', '--force'):
+			force = True
+		elif argv[i] in ('-s', '--single-file'):
+			single = True
+		elif argv[i] in ('-l', '--local'):
+			local = argv[i+1]
+			i += 1
+		elif argv[i] in ('-a', '--all-files'):
+			all_files = True
+		elif argv[i] in ('-z', '--silent'):
+			verbose = 0
+		elif argv[i] in ('-h', '--help'):
+			print(helptext)
+			return
+		elif argv[i] == '--':
+			paths += argv[i+1:]
+			break
+		else:
+			paths.append(argv[i])
+		i += 1
+
+	if not output or not paths:
+		print("An output directory and at least one presentation are required")
+		return 1
+
+	if provider and provider not in presentation.Presentation.providers:
+		print("Unknown provider", provider)
+		return 1
+
+	if local and not os.path.isfile(os.path.join(local, 'js', 'reveal.js')):
+		print("Not a Reveal.js repository:", local)
+		return 1
+
+	# presentations are exported to a directory named after them
+	slugs = {}
+	for path in paths:
+		slug = os.path.split(os.path.realpath(path))[-1]
+
+		if slug in slugs:
+			print("Both {} and {} would be exported to {}".format(slugs[slug], path, slug))
+			return 1
+
+		slugs[slug] = path
+
+	econf = ExportConf(output, provider, hardlink, force, single,
+		local and os.path.realpath(local), all_files)
+	os.makedirs(output, exist_ok = True)
+
+	t = time.perf_counter()
+
+	# single files don't link to WaterSlide's resources
+	if not single:
+		export_resources(econf)
+
+	failed = 0
+
+	with futures.ProcessPoolExecutor(max_workers = jobs) as executor:
+		for r in executor.map(export_single if single else export_presentation,
+				paths, repeat(econf)):
+			if r.error:
+				failed += 1
+				print("Could not export {}: {}".format(r.path, r.error))
+				continue
+
+			if verbose > 0:
+				print(" - {:<20} {:4} written {:4} unchanged {:4} removed ({:.2f} s)".format(
+					r.slug, r.written, r.skipped, r.removed, r.time))
+
+			for address in r.external:
+				print("   not inlined:", address)
+
+	if verbose > 0:
+		print("exported {} of {} presentations in {:.2f} s".format(
+			len(paths) - failed, len(paths), time.perf_counter() - t))
+
+	return 1 if failed else None
+
+## @}
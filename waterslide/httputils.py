@@ -5,14 +5,15 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from datetime import datetime
-import pytz
 import os
+import time
 from aiohttp import web
 from email import utils
 from collections import namedtuple
-from waterslide import multiplex
+from waterslide import multiplex, cache, metrics, timing, monitor, profiling, accesslog
 import base64
+import inspect
+import hashlib
 
 ##
 #  @defgroup httputils HTTP related utility functions/classes/definitions
@@ -28,119 +29,343 @@ import base64
 # to rewrite any of the request handlers whenever we change frameworks
 HTTP_Response	= namedtuple('HTTP_Response',	('code', 'headers', 'body'))
 
-## Named tuple used to describe a request url
-HTTP_URL	= namedtuple('HTTP_URL',	('scheme', 'host', 'path', 'query'))
+## Request, as the request handlers see it
+#
+# A view of the request of the framework, which only holds the rewritten path.
+# Everything else is looked up on the framework's request when it's used, so
+# converting a request makes a single small object. The request is its own
+# url: request.url.path is the rewritten path, and request.url.query the query.
+class HTTP_Request():
+
+	__slots__ = ('parent_object', 'path')
+
+	## @param self		Object pointer
+	# @param parent_object	Request of the framework
+	# @param path		Path of the request, relative to the presentation
+	def __init__(self, parent_object, path):
+		self.parent_object = parent_object
+		self.path = path
 
-## Named tuple used to describe a request
-HTTP_Request	= namedtuple('HTTP_Request', 	('version', 'method', 'headers', 'url','body', 'parent_object'))
+	version	= property(lambda self: self.parent_object.version)
+	method	= property(lambda self: self.parent_object.method)
+	headers	= property(lambda self: self.parent_object.headers)
+	scheme	= property(lambda self: self.parent_object.scheme)
+	host	= property(lambda self: self.parent_object.host)
+	query	= property(lambda self: self.parent_object.query)
+	url	= property(lambda self: self)
+
+	## Body of the request, as read by the framework (a coroutine for aiohttp)
+	@property
+	def body(self):
+		return self.parent_object.read()
 
 ## Convert a request from the representation of aiohttp to a HTTP_Request
 # @param request	Request to convert
 # @param rwrite		Callable which rewrites the path. Can be used to get
 #			A minfo part, or strip of certain characters, etc
 def convert(request, rwrite = lambda r:r.path):
-	# convert the aiohttp request object to a HTTP_Request tuple
-	# so that it can be processed by the HTTP_Presentation class
-	return HTTP_Request(
-		version = request.version,
-		method = request.method,
-		headers = request.headers,
-		url = HTTP_URL(
-			scheme	= request.scheme,
-			host	= request.host,
-			# url relative to the presentation directory
-			path	= rwrite(request),
-			query	= request.query,
-		),
-		body = request.read(),
-		parent_object = request
-	)
+	return HTTP_Request(request, rwrite(request))
+
+## Size of the pieces in which streamed responses are written
+stream_chunk = 1 << 16
+
+## Write data to a streaming response, and wait until it can take more
+# @param resp	aiohttp StreamResponse
+# @param data	Bytes-like object to write
+async def stream_write(resp, data):
+	ret = resp.write(data)
+
+	# aiohttp 3 returns a coroutine which drains the buffer, older versions
+	# write synchronously and drain separately
+	if inspect.isawaitable(ret):
+		await ret
+	else:
+		await resp.drain()
+
+## Stream a HTTP_Response whose body is a list of segments
+# @param request	The request of the framework
+# @param response	HTTP_Response named tuple. Its body is a list of
+#			bytes-like segments
+# @param timings	timing.Timings of the request, to which the time spent
+#			writing the body is added as the export phase, or None
+#
+# The segments are written without copying or re-encoding them, in pieces
+# of at most stream_chunk bytes, so that the client gets the first ones
+# (usually the head of the document) before the rest is written.
+async def stream(request, response, timings = None):
+	start = time.perf_counter()
+	resp = web.StreamResponse(status = response.code, headers = response.headers)
+	await resp.prepare(request)
+	
+	for segment in response.body:
+		view = memoryview(segment)
+		
+		for i in range(0, len(view), stream_chunk):
+			await stream_write(resp, view[i:i + stream_chunk])
+	
+	await resp.write_eof()
+	
+	if timings is not None:
+		timings.add('export', time.perf_counter() - start)
+		timing.report(request.path, timings)
+	
+	return resp
+
+## Response without a body, to a HEAD request or with code 304
+#
+# aiohttp sends a Content-Length of 0 with responses without a body, or
+# chunks them when no length is given. The headers of these responses
+# describe the body a GET request would get, so only a Content-Length set by
+# the handler is sent, and nothing is written after the headers.
+class Bodiless(web.StreamResponse):
+	_length_check = False
 
 ## transform a standard HTTP_Response named tuple to a form the webserver understands
-def export(response):
+# @param response	HTTP_Response named tuple
+# @param request	The request of the framework. Required for responses
+#			with a segmented body
+#
+# Responses whose body is a list (or tuple) of bytes-like segments are
+# streamed. For these a coroutine is returned, which aiohttp awaits for us.
+# Responses whose body is None are sent without one.
+def export(response, request = None):
+	if isinstance(response.body, (list, tuple)):
+		return stream(request, response)
+	
+	if response.body is None:
+		return Bodiless(status = response.code, headers = response.headers)
+	
 	return web.Response(
 		status  = response.code,
 		headers = response.headers,
 		body    = response.body,
 	)
 
+## Validators of a version of a resource, and the responses to send for it
+Validators = namedtuple('Validators', ('last_modified', 'etag', 'fresh', 'not_modified'))
+
+## Validators of resources, by (modification time, entity tag, content type)
+validators = cache.lru(1024)
+
+## Responses to send when caching is disabled, by content type
+uncached = {}
+
+## Get the response to send when caching is disabled
+# @param content_type	Content type of the resource, or None
+def uncached_response(content_type = None):
+	ret = uncached.get(content_type)
+	
+	if ret is None:
+		ret = uncached[content_type] = HTTP_Response(code = 200,
+			headers = {'Content-type': content_type} if content_type else {},
+			body = None)
+	
+	return ret
+
+## Get the validators of a version of a resource
+# @param tstamp		Modification time of the resource
+# @param etag		Entity tag of the resource, or None to derive a weak
+#			one from the modification time
+# @param content_type	Content type of the resource, sent along with it
+def make_validators(tstamp, etag = None, content_type = None):
+	lm = utils.formatdate(int(tstamp), usegmt = True)
+	etag = etag or 'W/"{:x}"'.format(int(tstamp * 1000000))
+	
+	headers = {
+		"Cache-Control":"must-revalidate",
+		"Last-Modified": lm,
+		"ETag": etag,
+		}
+	
+	return Validators(
+		last_modified = lm,
+		etag = etag,
+		fresh = HTTP_Response(code = 200,
+			headers = {**headers, 'Content-type': content_type} if content_type else headers,
+			body = None),
+		not_modified = HTTP_Response(code = 304, headers = headers, body = None),
+		)
+
+## Check whether an If-None-Match header matches an entity tag
+# @param header	Value of the header
+# @param etag	Entity tag of the resource
+#
+# Tags are compared weakly, as required for If-None-Match
+def etag_matches(header, etag):
+	if header == etag:
+		return True
+	
+	opaque = etag[2:] if etag.startswith('W/') else etag
+	
+	for tag in header.split(','):
+		tag = tag.strip()
+		
+		if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == opaque:
+			return True
+	
+	return False
+
+## Check whether a resource wasn't modified since an If-Modified-Since header
+# @param header	Value of the header
+# @param tstamp	Modification time of the resource
+def not_modified_since(header, tstamp):
+	try:
+		date = utils.parsedate_tz(header)
+	except (TypeError, ValueError, IndexError):
+		return False
+	
+	# invalid dates are ignored
+	return date is not None and int(tstamp) <= utils.mktime_tz(date)
+
 ## Check whether the client has the resource cached, and send the appropriate headers
-# @param self		Object pointer
-# @param request	The request currently being processed
 # @param filename	Source file of the request
+# @param request	The request currently being processed
 # @param do_cache	Whether to enable caching or not
 # @param mtime		Use this mtime instead of stat-ing it yourself
+# @param etag		Entity tag of the resource. Derived from the
+#			modification time when not given
+# @param content_type	Content type of the resource, added to the headers
+#			of the response when it isn't cached
+#
+# @return		HTTP_Response named tuple, with code 304 when the
+#			client has the resource cached, and the caching headers
+#			to send along otherwise
 #
-# @return		Boolean if the the client has the resource cached,
-#			so that the calling function knows what to do further
-def client_has_cached(filename, request, do_cache = True, mtime = None):
-
-	# decode the last modified header here instead of relying on
-	# a specific implementation which decodes it for us
-	imsp = datetime(
-		*utils.parsedate(
-			request.headers.get(	'if-modified-since',
-						'Thu, 1 Jan 1970 00:00:00 GMT'
-					)
-				)[:6]
-		).replace(tzinfo=pytz.utc)
-	
-	# strip of the microseconds, so we can compare the objects without having to round.
+# The validators and responses are made once per version of a resource. The
+# headers of the request are compared with them as they are first, since
+# clients usually send back the exact values they got. If-None-Match takes
+# precedence over If-Modified-Since (RFC 7232, section 6). The returned
+# responses are shared, and should not be modified. They have no body:
+# handlers send them with their body in it (response._replace(body = ...)),
+# or through head_response for HEAD requests.
+@timing.timed('validate')
+def client_has_cached(filename, request, do_cache = True, mtime = None, etag = None,
+content_type = None):
+	
+	if not do_cache:
+		return uncached_response(content_type)
 	
 	tstamp = mtime or os.path.getmtime(filename)
+	v = validators.get((tstamp, etag, content_type),
+		lambda: make_validators(tstamp, etag, content_type))
+	
+	inm = request.headers.get('If-None-Match')
+	
+	if inm is not None:
+		return v.not_modified if etag_matches(inm, v.etag) else v.fresh
+	
+	ims = request.headers.get('If-Modified-Since')
+	
+	if ims is not None and (ims == v.last_modified or not_modified_since(ims, tstamp)):
+		return v.not_modified
+	
+	return v.fresh
+
+## Get the response to a HEAD request
+# @param response	Response to the GET request without its body, as
+#			returned by client_has_cached
+# @param length	Length of the body of the GET response, if it is known
+#			without making the body
+#
+# The headers are those of the GET response. When the length isn't known,
+# the Content-Length is left out (RFC 7230, section 3.3.2).
+def head_response(response, length = None):
+	if length is None:
+		return response
+	
+	return response._replace(headers = {**response.headers, 'Content-Length': str(length)})
+
+## Content hashes of files, by (filename, mtime, size)
+file_digests = cache.lru(1024)
+
+## Hash the contents of a file
+# @param fname	File to hash
+# @return	Hexadecimal digest of the file
+#
+# The digest is only computed again when the file has been modified
+def file_digest(fname):
 	
-	lm = datetime.utcfromtimestamp(tstamp).replace(tzinfo=pytz.utc, microsecond = 0)
-	
-	if do_cache and imsp == lm:
-	
-		return HTTP_Response(
-			code = 304, 
-			headers = {
-				"Cache-Control":"must-revalidate"
-				} if do_cache else {},
-			body = ""
-			)
-	else:			
-		return HTTP_Response(
-			code = 200, 
-			headers = {
-				"Cache-Control":"must-revalidate",
-				"Last-Modified": lm.strftime('%a, %d %b %Y %H:%M:%S GMT')
-				} if do_cache else {},
-			body = ""
-			)
-
-## Log a request to stdout
-# @param self		Object pointer
-# @param request	Request object of the framework
+	def compute():
+		h = hashlib.sha1()
+		
+		with open(fname, 'rb') as f:
+			for block in iter(lambda: f.read(stream_chunk), b''):
+				h.update(block)
+		
+		return h.hexdigest()
+	
+	st = os.stat(fname)
+	
+	return file_digests.get((fname, st.st_mtime_ns, st.st_size), compute)
+
+## Hash the contents of a file which have already been read
+# @param fname	File which was read
+# @param st	stat result of the file, from when it was read
+# @param data	Contents of the file
+# @return	Hexadecimal digest of the file, as file_digest returns it
+#
+# The digest is remembered for file_digest, so the file isn't read again
+def data_digest(fname, st, data):
+	return file_digests.get((fname, st.st_mtime_ns, st.st_size),
+		lambda: hashlib.sha1(data).hexdigest())
+
+## Contents of the static files of the presentations, shared between files
+# with the same contents. Its budget is set from the presentation
+# configuration on startup. The files are read into memory, since they can be
+# edited while they are served
+static_files = cache.filecache(identify = data_digest)
+
+metrics.register_cache('static_files', static_files.status, lambda: static_files.buffers)
+metrics.register_cache('file_digests', file_digests.status, lambda: file_digests.cache)
+metrics.register_cache('validators', validators.status, lambda: validators.cache)
+
+## Log a request
+# @param request	HTTP_Request
 # @param response	HTTP_Response named tuple
-def log_request(request, response):
-
-	# build a query string from a dictionary
-	def build_query_string(d):
-		return '?' + '&'.join([qstr(e, d[e]) for e in d.keys()]) if len(d) else ''
-	
-	# build a query substring correctly
-	def qstr(a, b):
-		return '{}={}'.format(a,b) if b else a
-
-	print("HTTP/{}.{} {} {} {}".format(
-		request.version.major, request.version.minor,
-		response.code,
-		request.method,
-		'{}//{}{}{}'.format(
-			*request.url[:2],
-			request.parent_object.path,
-			build_query_string(request.url.query))
-		)
-	)
+# @param duration	Time (in seconds) taken to handle the request
+#
+# Only a record of the request is made here, it is formatted and written
+# later by the access log.
+def log_request(request, response, duration):
+	body = response.body
+	
+	if isinstance(body, (list, tuple)):
+		size = sum(len(s) for s in body)
+	elif isinstance(body, str):
+		size = len(body.encode('utf-8'))
+	elif body is not None:
+		size = len(body)
+	else:
+		size = None
+	
+	accesslog.log.add(accesslog.Record(
+		time	= time.time(),
+		remote	= getattr(request.parent_object, 'remote', None),
+		version	= request.version,
+		method	= request.method,
+		scheme	= request.url.scheme,
+		host	= request.url.host,
+		path	= request.parent_object.path,
+		query	= request.url.query,
+		code	= response.code,
+		size	= size,
+		duration = duration,
+		referer	= request.headers.get('Referer'),
+		agent	= request.headers.get('User-Agent'),
+		))
+
+## Phases of a request timed by the translator
+convert_phase = timing.phase('convert')
+handler_phase = timing.phase('handler')
+export_phase = timing.phase('export')
 
 ## HTTP_Request translator system for the aiohttp framework
 # @param rewrite	Callable used to rewrite the path
 # @param logger		Function to log the request. It must have the
-#			<request>, <response> signature, and it can expect to
-#			receive a HTTP_Request and HTTP_Response named tuples
-def aio_translate(rewrite = lambda r:r.path, logger = lambda r,R:True):
+#			<request>, <response>, <duration> signature, and it can
+#			expect to receive a HTTP_Request, a HTTP_Response
+#			named tuple, and the seconds taken to handle it
+def aio_translate(rewrite = lambda r:r.path, logger = lambda r,R,t:True):
 	
 	## translator initialisation function
 	# @param func	Function to be decorated
@@ -152,14 +377,40 @@ def aio_translate(rewrite = lambda r:r.path, logger = lambda r,R:True):
 		# object. This way, it can be used with functions and
 		# class methods
 		def decorator(*args, **kwargs):
-			args = list(args)
-			args[-1] = convert(args[-1], rewrite)
-			
-			response = func(*args, **kwargs)
-			
-			logger(args[-1], response)
+			start = time.perf_counter()
+			timings = timing.begin()
 			
-			return export(response)
+			try:
+				with convert_phase:
+					request = convert(args[-1], rewrite)
+				
+				with handler_phase:
+					response = func(*args[:-1], request, **kwargs)
+				
+				logger(request, response, time.perf_counter() - start)
+				
+				# segmented bodies are written after the headers are
+				# sent, so their export phase is only logged
+				if isinstance(response.body, (list, tuple)):
+					if timings and timing.enabled:
+						response = response._replace(headers = {
+							**response.headers,
+							'Server-Timing': timings.header()
+							})
+					
+					return stream(args[-1], response, timings if timing.log else None)
+				
+				with export_phase:
+					ret = export(response, args[-1])
+				
+				if timings and timing.enabled:
+					ret.headers['Server-Timing'] = timings.header()
+				
+				timing.report(args[-1].path, timings)
+				
+				return ret
+			finally:
+				timing.end()
 		
 		return decorator
 	return boot
@@ -172,6 +423,11 @@ def init_static(app, pconf, sconf):
 
 	dirname = os.path.split(__file__)[0]
 
+	# the shared assets are under /waterslide too, so they go first
+	if pconf.share_assets:
+		from waterslide import assets
+		assets.registry.register(app)
+
 	# check if static routing is enabled
 	if pconf.static == True:
 		# add a static route to resources waterslide provides
@@ -197,6 +453,25 @@ def init_static(app, pconf, sconf):
 # @param sconf	Server configuration
 # @param mconf	Multiplexing configuration
 def startup_defaults(app, pconf, sconf, mconf):
+	static_files.conf(budget = pconf.static_cache)
+	
+	timing.enabled = sconf.server_timing
+	timing.log = sconf.log_timing
+	
+	# the metrics are under /waterslide too, so they go before the static routes
+	if sconf.metrics:
+		metrics.setup(app)
+	
+	if sconf.loop_monitor:
+		monitor.Monitor(threshold = sconf.loop_monitor).setup(app)
+	
+	accesslog.log.conf(fmt = sconf.log_format, sample = sconf.log_sample,
+		depth = sconf.log_queue)
+	accesslog.log.setup(app)
+	
+	if sconf.profiling:
+		profiling.Profiler(sconf.profiling, seconds = sconf.profile_seconds).setup(app)
+	
 	multiplex.start_socket_io(app, mconf)
 	init_static(app, pconf, sconf)
 
@@ -6,13 +6,12 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import time
-import sass
-from waterslide import presentation, cache, httputils, multiplex
+from waterslide import presentation, cache, httputils, multiplex, assets, metrics
 from aiohttp import web
 import collections
 import os
 from sys import argv
-from waterslide.serve import SConf
+from waterslide.serve import SConf, start
 
 ##
 #  @defgroup manager Presentation manager module
@@ -47,8 +46,8 @@ class dynamic():
 		if not self.exists:
 			return
 		
-		self.mtime = os.path.getmtime(path)
-		self.sass = sass.compile(filename=path)
+		self.mtime = assets.mtime(path)
+		self.sass = assets.compile_sass(path)
 	
 	@property
 	def exists(self):
@@ -56,19 +55,16 @@ class dynamic():
 	
 	def handle(self, request):
 		
-		c = httputils.client_has_cached(self.path, request)
+		c = httputils.client_has_cached(self.path, request, mtime = self.mtime,
+			content_type = 'text/css')
 		
 		if c.code == 304:
 			return c
 		
-		return httputils.HTTP_Response(
-			code = c.code,
-			headers = {
-				**c.headers,
-				'Content-type':'text/css',
-				},
-			body = self.sass
-			)
+		if request.method == 'HEAD':
+			return httputils.head_response(c, len(self.sass))
+		
+		return c._replace(body = self.sass)
 
 class Manager():
 	
@@ -95,8 +91,10 @@ class Manager():
 	# @param self	Object pointer
 	# @param app	app to attach to
 	def register(self, app):
-		app.router.add_route('GET', '/{pres:.*}/', self.handle_pres)
-		app.router.add_route('GET', '/{tail:.*\.scss}', self.handle_dynamic)
+		for method in ('GET', 'HEAD'):
+			app.router.add_route(method, '/{pres:.*}/', self.handle_pres)
+			app.router.add_route(method, '/{pres:.*}/' + presentation.sw_name, self.handle_worker)
+			app.router.add_route(method, '/{tail:.*\.scss}', self.handle_dynamic)
 		app.router.add_static('/', self.docroot)
 		
 		return self
@@ -112,6 +110,8 @@ class Manager():
 		if p.isreal:
 			return p
 		else:
+			if p.import_error:
+				print(ppath + ":", p.import_error)
 			return notfound(ppath)
 	
 	## Handle a request for a presentation
@@ -122,10 +122,17 @@ class Manager():
 	def handle_pres(self, request):
 		return self.find(request.url.path).handle(request)
 	
+	## Handle a request for the offline service worker of a presentation
+	# @copydetails handle_pres
+	@httputils.aio_translate(rewrite = lambda r:r.path[1:],
+					logger = httputils.log_request)
+	def handle_worker(self, request):
+		return self.find(request.url.path[:-len(presentation.sw_name)]).handle(request)
+	
 	## Get the object to be used to serve a dynamic file request
 	# @param self	Object pointer
 	# @param path	Path to the file, relative to the document root
-	@cache.cache(valid = lambda k,v: v.exists and v.mtime == os.path.getmtime(v.path))
+	@cache.cache(valid = lambda k,v: v.exists and v.mtime == assets.mtime(v.path))
 	def get_dyn_ctnt(self, pname):
 		
 		ppath = os.path.join(self.docroot, pname)
@@ -144,6 +151,10 @@ class Manager():
 	def handle_dynamic(self, request):
 		return self.get_dyn_ctnt(request.url.path).handle(request)
 
+metrics.register_cache('manager_presentations', Manager.find.status, Manager.find.contents)
+metrics.register_cache('manager_dynamic', Manager.get_dyn_ctnt.status,
+	Manager.get_dyn_ctnt.contents)
+
 ## Subcommand handling function for the manage subcommand
 def serve(argn):
 
@@ -187,6 +198,6 @@ Options:
 	man = Manager(docroot, pconf = pconf)
 	man.register(app)
 	
-	web.run_app(app, host=sconf.address, port=sconf.port)
+	start(app, sconf, mconf)
 
 ## @}
@@ -0,0 +1,275 @@
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+import bisect
+from aiohttp import web
+
+##
+#  @defgroup metrics Metrics module
+#
+# Counters, gauges and histograms describing the server, exposed in the
+# Prometheus text format under /waterslide/metrics when enabled (the
+# --metrics option).
+#
+# Metrics are plain dictionaries keyed by their label values, so updating one
+# costs a dictionary lookup and an addition. The statistics of the caches are
+# only collected when the metrics are requested.
+#
+#  @addtogroup metrics
+#  @{
+#
+
+## Address of the metrics
+address = '/waterslide/metrics'
+
+## Every metric, in the order they are exposed
+metrics = []
+
+## Caches to report, name -> callable returning their status
+caches = {}
+
+## Contents of the caches, name -> callable returning the cached objects
+cache_contents = {}
+
+## Base class of the metrics
+class Metric():
+
+	## Type of the metric, as exposed
+	kind = 'untyped'
+
+	## @param self		Object pointer
+	# @param name		Name of the metric
+	# @param help		Description of the metric
+	# @param labels	Names of the labels of the metric
+	def __init__(self, name, help, labels = ()):
+		self.name = name
+		self.help = help
+		self.labels = labels
+		# label values -> value
+		self.values = {}
+
+		metrics.append(self)
+
+	## Format the label values of a sample
+	def format_labels(self, values, extra = ()):
+		pairs = list(zip(self.labels, values)) + list(extra)
+
+		if not pairs:
+			return ''
+
+		return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+			.replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs) + '}'
+
+	## Get the samples of the metric
+	# @return	Generator of the lines of the samples
+	def samples(self):
+		for values, v in sorted(self.values.items()):
+			yield '{}{} {}'.format(self.name, self.format_labels(values), v)
+
+	## Get the metric in the text format
+	def expose(self):
+		return '# HELP {} {}\n# TYPE {} {}\n'.format(self.name, self.help, self.name, self.kind) + \
+			''.join(s + '\n' for s in self.samples())
+
+## Monotonically increasing count
+class Counter(Metric):
+
+	kind = 'counter'
+
+	## Increase the counter
+	# @param self	Object pointer
+	# @param labels	Tuple of the label values
+	# @param n	Amount to increase it with
+	def inc(self, labels = (), n = 1):
+		self.values[labels] = self.values.get(labels, 0) + n
+
+## Value which can go up and down
+class Gauge(Metric):
+
+	kind = 'gauge'
+
+	## Set the gauge
+	def set(self, value, labels = ()):
+		self.values[labels] = value
+
+	## Increase (or decrease, with a negative n) the gauge
+	def inc(self, labels = (), n = 1):
+		self.values[labels] = self.values.get(labels, 0) + n
+
+## Distribution of observed values
+class Histogram(Metric):
+
+	kind = 'histogram'
+
+	## @param self		Object pointer
+	# @param name		Name of the metric
+	# @param help		Description of the metric
+	# @param buckets	Upper bounds of the buckets, ascending
+	# @param labels	Names of the labels of the metric
+	def __init__(self, name, help, buckets, labels = ()):
+		super().__init__(name, help, labels)
+		self.buckets = tuple(buckets)
+
+	## Observe a value
+	# @param self	Object pointer
+	# @param value	The value
+	# @param labels	Tuple of the label values
+	def observe(self, value, labels = ()):
+		h = self.values.get(labels)
+
+		# a count per bucket (and one for +Inf), and the sum
+		if h is None:
+			h = self.values[labels] = [0] * (len(self.buckets) + 1) + [0]
+
+		h[bisect.bisect_left(self.buckets, value)] += 1
+		h[-1] += value
+
+	def samples(self):
+		for values, h in sorted(self.values.items()):
+			total = 0
+
+			for bound, n in zip(self.buckets + ('+Inf',), h):
+				total += n
+				yield '{}_bucket{} {}'.format(self.name,
+					self.format_labels(values, (('le', bound),)), total)
+
+			yield '{}_sum{} {}'.format(self.name, self.format_labels(values), h[-1])
+			yield '{}_count{} {}'.format(self.name, self.format_labels(values), total)
+
+## Request latency buckets, in seconds
+latency_buckets = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+## Response size buckets, in bytes
+size_buckets = tuple(1 << i for i in range(8, 26, 2))
+
+requests = Counter('waterslide_http_requests_total',
+	'Requests, by route and status code', ('route', 'code'))
+latency = Histogram('waterslide_http_request_duration_seconds',
+	'Time taken to handle requests, by route', latency_buckets, ('route',))
+sizes = Histogram('waterslide_http_response_size_bytes',
+	'Size of the response bodies, by route', size_buckets, ('route',))
+sass_compiles = Histogram('waterslide_sass_compile_duration_seconds',
+	'Time taken to compile sass stylesheets', latency_buckets)
+mx_connections = Gauge('waterslide_multiplex_connections',
+	'Clients connected to the multiplex server')
+loop_lag = Histogram('waterslide_event_loop_lag_seconds',
+	'Delay of the event loop in running a scheduled task', latency_buckets)
+loop_blocked = Counter('waterslide_event_loop_blocked_samples_total',
+	'Samples of the blocked event loop, by the function blocking it', ('function',))
+
+## Register a cache to report
+# @param name		Name of the cache in the metrics
+# @param status		Callable returning the status of the cache (a namedtuple
+#			with hits, misses and evictions, and optionally csize or
+#			entries and resident)
+# @param contents	Callable returning the mapping of the cached objects,
+#			to measure their memory when profiling
+def register_cache(name, status, contents = None):
+	caches[name] = status
+
+	if contents:
+		cache_contents[name] = contents
+
+## Get the metrics of the caches, in the text format
+def expose_caches():
+	fields = (
+		('hits', 'counter', 'Cache hits'),
+		('misses', 'counter', 'Cache misses'),
+		('evictions', 'counter', 'Entries evicted from the cache'),
+		('csize', 'gauge', 'Entries in the cache'),
+		('entries', 'gauge', 'Entries in the cache'),
+		('resident', 'gauge', 'Bytes kept in the cache'),
+		)
+
+	status = {name: func() for name, func in sorted(caches.items())}
+	out = []
+
+	for field, kind, help in fields:
+		name = 'waterslide_cache_' + {'csize': 'entries'}.get(field, field) + \
+			('_total' if kind == 'counter' else '')
+
+		lines = ['{}{{cache="{}"}} {}'.format(name, c, getattr(s, field))
+			for c, s in status.items() if hasattr(s, field)]
+
+		if not lines:
+			continue
+
+		# csize and entries are the same metric
+		if not any(o.startswith('# HELP ' + name + ' ') for o in out):
+			out.append('# HELP {} {}\n# TYPE {} {}\n'.format(name, help, name, kind))
+
+		out.append(''.join(l + '\n' for l in lines))
+
+	return ''.join(out)
+
+## Get the ratio of the not modified responses per route, in the text format
+def expose_not_modified():
+	name = 'waterslide_http_not_modified_ratio'
+	totals = {}
+
+	for (route, code), n in requests.values.items():
+		t = totals.setdefault(route, [0, 0])
+		t[0] += n
+		t[1] += n if code == 304 else 0
+
+	return '# HELP {} Ratio of the responses which were 304 Not Modified, by route\n' \
+		'# TYPE {} gauge\n'.format(name, name) + \
+		''.join('{}{{route="{}"}} {}\n'.format(name, route, m / n)
+			for route, (n, m) in sorted(totals.items()))
+
+## Get all the metrics in the text format
+def expose():
+	return ''.join(m.expose() for m in metrics) + expose_not_modified() + expose_caches()
+
+## Get the name of the route of a request, to use as a label
+def route_name(request):
+	resource = getattr(request.match_info.route, 'resource', None)
+	info = resource.get_info() if resource else {}
+
+	return info.get('formatter') or info.get('path') or info.get('prefix') or 'unknown'
+
+## Middleware counting and timing the requests
+# @param app		Web application
+# @param handler	Handler to wrap
+async def middleware(app, handler):
+
+	async def measure(request):
+		t = time.perf_counter()
+		code = 500
+		size = 0
+
+		try:
+			resp = await handler(request)
+			code = resp.status
+			size = resp.content_length or getattr(resp, 'body_length', 0) or 0
+			return resp
+		except web.HTTPException as e:
+			code = e.status
+			raise
+		finally:
+			route = route_name(request)
+			latency.observe(time.perf_counter() - t, (route,))
+			sizes.observe(size, (route,))
+			requests.inc((route, code))
+
+	return measure
+
+## Request handler for the metrics
+def handle(request):
+	return web.Response(
+		body = expose().encode('utf-8'),
+		headers = {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+		)
+
+## Enable the metrics on a web application
+# @param app	Web application, which hasn't started yet
+def setup(app):
+	app.middlewares.append(middleware)
+	app.router.add_route('GET', address, handle)
+
+## @}
@@ -0,0 +1,135 @@
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import sys
+import time
+import asyncio
+import threading
+from waterslide import metrics
+
+##
+#  @defgroup monitor Event loop monitor module
+#
+# Many handlers read files and compile stylesheets on the event loop, which
+# delays everything else the loop is doing, multiplex messages included. The
+# monitor measures how late the loop wakes up a task which sleeps at a fixed
+# interval (the lag), and exports it as a metric.
+#
+# A watchdog thread checks whether the loop is still waking that task up. When
+# it hasn't for longer than the threshold, the loop is blocked, and the watchdog
+# samples the stack of the loop's thread to find the WaterSlide function which
+# is blocking it. Samples are counted per function, and every blocking call is
+# logged once.
+#
+#  @addtogroup monitor
+#  @{
+#
+
+## Directory of the WaterSlide package, to recognise its functions
+package = os.path.dirname(os.path.abspath(__file__))
+
+## Get the name of the innermost WaterSlide function in a stack
+# @param frame	Innermost frame of the stack
+# @return	(name, location) of the function, or (None, None) when the
+#		stack has no WaterSlide functions
+def blocking_function(frame):
+	while frame is not None:
+		code = frame.f_code
+
+		if code.co_filename.startswith(package) and code.co_filename != __file__:
+			return '{}.{}'.format(frame.f_globals.get('__name__', '?'),
+				getattr(code, 'co_qualname', code.co_name)), \
+				'{}:{}'.format(os.path.relpath(code.co_filename, package), frame.f_lineno)
+
+		frame = frame.f_back
+
+	return None, None
+
+## Event loop monitor
+class Monitor():
+
+	## @param self		Object pointer
+	# @param threshold	Time (in seconds) the loop must be blocked for
+	#			before its stack is sampled
+	# @param interval	Time (in seconds) between the lag measurements
+	def __init__(self, threshold = .1, interval = .05):
+		self.threshold = threshold
+		self.interval = interval
+		## Last time the loop woke the measuring task up
+		self.beat = time.monotonic()
+		## Identifier of the loop's thread
+		self.thread = None
+		# time of the beat the current block was reported at
+		self.reported = None
+		self.task = None
+		self.stopped = threading.Event()
+
+	## Measure the lag of the loop, until cancelled
+	# @param self	Object pointer
+	# @param loop	Event loop to measure
+	async def measure(self, loop):
+		while True:
+			t = loop.time()
+			await asyncio.sleep(self.interval)
+
+			self.beat = time.monotonic()
+			metrics.loop_lag.observe(max(loop.time() - t - self.interval, 0))
+
+	## Sample the loop's thread while it is blocked, until stopped
+	# @param self	Object pointer
+	def watch(self):
+		while not self.stopped.wait(self.threshold / 2):
+			beat = self.beat
+			blocked = time.monotonic() - beat - self.interval
+
+			if blocked < self.threshold:
+				continue
+
+			name, location = blocking_function(sys._current_frames().get(self.thread))
+			metrics.loop_blocked.inc((name or 'unknown',))
+
+			if self.reported != beat:
+				self.reported = beat
+				print("Event loop blocked for {:.0f} ms in {} ({})".format(
+					blocked * 1000, name or 'unknown', location or '?'))
+
+	## Start monitoring the running loop
+	# @param self	Object pointer
+	# @param app	Web application which is starting
+	async def start(self, app):
+		loop = asyncio.get_event_loop()
+
+		self.thread = threading.get_ident()
+		self.beat = time.monotonic()
+		self.stopped.clear()
+		self.task = loop.create_task(self.measure(loop))
+
+		threading.Thread(target = self.watch, daemon = True,
+			name = 'waterslide-monitor').start()
+
+	## Stop monitoring
+	# @param self	Object pointer
+	# @param app	Web application which is shutting down
+	async def stop(self, app):
+		self.stopped.set()
+
+		if self.task:
+			self.task.cancel()
+
+	## Monitor the loop of a web application while it runs
+	# @param self	Object pointer
+	# @param app	Web application, which hasn't started yet
+	#
+	# The monitor starts with the application, so every worker process
+	# monitors its own loop.
+	def setup(self, app):
+		app.on_startup.append(self.start)
+		app.on_cleanup.append(self.stop)
+		return self
+
+## @}
@@ -7,13 +7,10 @@
 
 from sys import argv
 import os
-import socketio
 import random, string
-import netifaces
 import collections
 import time
 import hashlib
-from waterslide.httputils import HTTP_Response
 
 ##
 #  @defgroup multiplex Presentation multiplexing module
@@ -47,7 +44,11 @@ from waterslide.httputils import HTTP_Response
 
 ## Get the ip address of the host
 # @return Ip address of the host
+#
+# Enumerating the network interfaces is relatively slow, which is why this is
+# only done when the multiplex server address is actually needed
 def get_ip_addr():
+	import netifaces
 	
 	ips = []
 		
@@ -108,8 +109,22 @@ class MConf:
 	# of this value if do_multiplex is true
 	just_serve = False
 	
+	## Configured multiplex server address, None when not configured
+	_MX_server = None
+	
 	## Multiplex server address
-	MX_server = 'http://' + get_ip_addr() + ':9090'
+	#
+	# Defaults to the address of this host, which is only looked up on first
+	# use
+	@property
+	def MX_server(self):
+		if self._MX_server is None:
+			MConf._MX_server = 'http://' + get_ip_addr() + ':9090'
+		return self._MX_server
+	
+	@MX_server.setter
+	def MX_server(self, value):
+		self._MX_server = value
 	
 	## Current randomness length
 	rlen = 16
@@ -203,9 +218,21 @@ def start_socket_io(app, mconf):
 	if not mconf.startserver:
 		return
 
+	import socketio
+
 	print("Starting up SocketIO endpoint")
 	sio = socketio.AsyncServer()
 	sio.attach(app)
+	
+	from waterslide import metrics
+	
+	@sio.on('connect')
+	async def count_connect(sid, environ):
+		metrics.mx_connections.inc()
+	
+	@sio.on('disconnect')
+	async def count_disconnect(sid):
+		metrics.mx_connections.inc(n = -1)
 
 	@sio.on('multiplex-statechanged')
 	async def fwd_socketio_msg(sid, data):
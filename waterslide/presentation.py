@@ -12,11 +12,14 @@ import json
 import re
 from datetime import datetime
 from urllib.parse import urlparse
-import sass
 from collections import namedtuple
-from waterslide import serve, multiplex, httputils
+from waterslide import multiplex, httputils, cache, slides, template, shared, assets, metrics, timing
 from email import utils
 import base64
+import hashlib
+import mimetypes
+import time
+from concurrent import futures
 
 ##
 #  @defgroup presentation Presentation module
@@ -45,6 +48,54 @@ reveal_plugins = {
 	'print-pdf': '{ "src": "{}/plugin/print-pdf/print-pdf.js"}'
 }
 
+## Expression matching the sources in the Reveal.js dependencies
+plugin_src = re.compile(r'(["\']?src["\']?\s*:\s*)(["\'])(.*?)\2')
+
+## Name of the offline service worker, relative to the presentation
+sw_name = 'waterslide-sw.js'
+
+## YAML loader, the libyaml based one if PyYAML was built with it
+YAMLLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+## Parse a YAML document
+# @param text	String containing the YAML document
+# @return	The parsed document, or an empty dictionary if it is empty
+#
+# The parsed documents are cached by the hash of their text, so unchanged
+# configuration isn't parsed again when only the slides change. The returned
+# objects are shared, and should be treated as read only.
+@timing.timed('yaml')
+def parse_yaml(text):
+	return parse_yaml_cached(text, hashlib.sha1(text.encode('utf-8')).digest())
+
+## Parse a YAML document, cached by its digest
+# @param text	String containing the YAML document
+# @param digest	Digest of text, used as the cache key
+@cache.cache(depth = 256)
+def parse_yaml_cached(text, digest):
+	return yaml.load(text, Loader = YAMLLoader) or {}
+
+metrics.register_cache('yaml', parse_yaml_cached.status, parse_yaml_cached.contents)
+
+## Lazy slide delivery configuration
+#
+# initial is the amount of slides in the initial page, chunk the amount of
+# slides fetched at once, and distance how many slides ahead of the current
+# one should be loaded
+LazyConf = namedtuple('LazyConf', ('initial', 'chunk', 'distance'))
+
+## Defaults for lazy slide delivery
+lazy_defaults = LazyConf(initial = 3, chunk = 10, distance = 3)
+
+## Media configuration
+#
+# lazy is whether media should be loaded lazily, prefetch the amount of
+# slides ahead of the current one of which the media should be prefetched
+MediaConf = namedtuple('MediaConf', ('lazy', 'prefetch'))
+
+## Defaults for the media configuration
+media_defaults = MediaConf(lazy = True, prefetch = 2)
+
 ## Presentation configuration class
 class PConf:
 	
@@ -53,11 +104,15 @@ class PConf:
 		mconf = None,
 		cache = True,
 		static = True,
+		static_cache = 32 << 20,
+		share_assets = False,
 	):
 		self.provider = provider
 		self.mconf = mconf
 		self.cache = cache
 		self.static = static
+		self.static_cache = static_cache
+		self.share_assets = share_assets
 	
 	def load(self, mconf):
 		self.mconf = mconf
@@ -71,6 +126,13 @@ class PConf:
 
 --disable-static        Disable static file routes, for when another webserver
                         is handling them for us
+
+--static-cache <MiB>    Amount of memory used to keep frequently requested
+                        static files in. Defaults to 32, 0 disables it
+
+--share-assets          Link the stylesheets and scripts of the presentations
+                        by their content hash, so that copies of them in
+                        several presentations share one address
 '''
 	
 	def parse(self, argn):
@@ -81,6 +143,12 @@ class PConf:
 		elif argv[argn] in ("--disable-static",):
 			self.static = False
 			ret = 1
+		elif argv[argn] == "--share-assets":
+			self.share_assets = True
+			ret = 1
+		elif argv[argn] == "--static-cache":
+			self.static_cache = int(float(argv[argn+1]) * (1 << 20))
+			ret = 2
 		elif argv[argn] in ("-o", "--override"):
 			temp = argv[i+1]
 			
@@ -111,14 +179,21 @@ class ImportError(Exception):
 # serves the presentation over html
 class Presentation:
 	
-	## The presenation core
-	html_base = ""
+	## The presenation core, split into slides (slides.Deck)
+	deck = None
 	## Source files modification time
 	src_mtime = 0
 	## Path to the presentation
 	path = None
 	## Whether or not this object should be considered valid
 	valid = False
+	## Error which occurred during the last import, if any
+	import_error = None
+	
+	## Digest of the presentation source
+	src_digest = ''
+	## Digest of the server configuration file
+	sconf_digest = ''
 	
 	## Presentation configuration dictionary
 	config = {}
@@ -151,6 +226,14 @@ class Presentation:
 		
 		self.conf = conf
 		
+		self.templates = {}
+		
+		self.deck = slides.Deck()
+		self.deck.add_stage('html', self.render_slide)
+		self.deck.add_stage('media-html',
+			lambda s: slides.lazy_media(self.render_slide(s)))
+		self.deck.add_stage('assets', lambda s: slides.assets(s.html))
+		
 		if not conf or not os.path.isdir(path):
 			self.valid = False
 			return
@@ -164,10 +247,28 @@ class Presentation:
 			self.import_presentation()
 			self.import_configuration()
 			self.valid = True
+			self.import_error = None
 		except ImportError as e:
-			print(e)
+			self.import_error = e
 			self.valid = False
 	
+	## Digest identifying the current version of the presentation
+	#
+	# It changes whenever the source, the server configuration or the
+	# provider changes, and is the same across processes
+	@property
+	def digest(self):
+		return slides.digest(self.src_digest + self.sconf_digest + self.provider)
+	
+	## Digest identifying the current version of the page
+	#
+	# Besides the presentation, the page depends on the addresses its
+	# stylesheets and scripts resolve to
+	@property
+	def page_digest(self):
+		return slides.digest(self.digest + ' '.join(self.resolve(a) for a in
+			(self.config.get('styles') or []) + (self.config.get('scripts') or [])))
+	
 	@property
 	def basepath(self):
 		return self.providers.get(self.provider) or self.providers['cdnjs']
@@ -215,6 +316,8 @@ class Presentation:
 		with open(path , mode="r", encoding="utf-8") as f:
 		
 			fctnt = f.read()
+			
+			self.src_digest = slides.digest(fctnt)
 		
 			conf_and_html = re.split(separator, fctnt, 1)
 		
@@ -224,10 +327,60 @@ class Presentation:
 				self.config = self.parse_configuration(conf_and_html[0])
 
 				self.provider = self.conf.provider or self.config.get('provider') or "cdnjs"
-				self.html_base = conf_and_html[1]
+				self.deck.update(conf_and_html[1])
 			else:
 				self.provider = self.conf.provider or "cdnjs"
-				self.html_base = fctnt
+				self.deck.update(fctnt)
+	
+	## The presentation core, as it is put in the html tree
+	#
+	# Only the slides which changed since the last time are rendered again
+	@property
+	def html_base(self):
+		return self.deck.join(self.render_stage)
+	
+	## Get the media configuration
+	# @param self	Object pointer
+	# @return	MediaConf tuple, or None when not configured
+	#
+	# It is configured with the 'media' option, which is either true or a
+	# dictionary overriding the defaults
+	def media_conf(self):
+		mconf = self.config.get('media')
+		
+		if not mconf:
+			return None
+		
+		mconf = {**media_defaults._asdict(), **(mconf if isinstance(mconf, dict) else {})}
+		
+		return MediaConf(lazy = bool(mconf['lazy']), prefetch = max(int(mconf['prefetch']), 0))
+	
+	## Name of the deck stage which renders the slides
+	#
+	# When media should be lazy loaded, the slides are rendered through the
+	# stage which rewrites them to Reveal's lazy form
+	@property
+	def render_stage(self):
+		mconf = self.media_conf()
+		return 'media-html' if mconf and mconf.lazy else 'html'
+	
+	## Get the assets referenced by each top-level section
+	# @param self	Object pointer
+	# @return	Tuple containing a tuple of urls for each section
+	#
+	# The manifest is only computed again when the presentation changed
+	def asset_manifest(self):
+		return self.deck.section_stage('assets')
+	
+	## Render a single slide
+	# @param self	Object pointer
+	# @param slide	slides.Slide tuple to render
+	# @return	The markup to put in the html tree
+	#
+	# This is the 'html' stage of the deck, and is only called for slides
+	# which changed. Descendant classes can override this to transform slides
+	def render_slide(self, slide):
+		return slide.html
 	
 	## Import the configuration file, if it exists
 	# @param self	Object pointer
@@ -237,7 +390,12 @@ class Presentation:
 		
 		if os.path.exists(cfile):
 			with open(cfile, 'r') as f:
-				self.sconf = self.parse_configuration(f.read())
+				ctnt = f.read()
+				self.sconf = self.parse_configuration(ctnt)
+				self.sconf_digest = slides.digest(ctnt)
+		else:
+			self.sconf = {}
+			self.sconf_digest = ''
 	
 	## Function which figures out the title
 	# @param self	Object pointer
@@ -260,7 +418,7 @@ class Presentation:
 	# defaults to cdnjs
 	def parse_configuration(self, confstr):
 		try:
-			return yaml.load(confstr) or {}
+			return parse_yaml(confstr)
 		except yaml.YAMLError as exc:
 			raise ImportError('Invalid yaml') from exc
 
@@ -296,6 +454,11 @@ class Presentation:
 	# @return	String containing the links to the stylesheets
 	@property
 	def stylesheet_links(self):
+		return self.link_resources(self.link_stylesheet, self.stylesheets)
+	
+	## The addresses of all the stylesheets of the page
+	@property
+	def stylesheets(self):
 		
 		# stylesheets which are always needed. Default to black
 		# if no stylesheet was specified
@@ -303,8 +466,30 @@ class Presentation:
 			self.basepath + "/css/theme/{}.css" \
 					.format(self.config.get("theme", "black"))]
 		
-		return self.link_resources(self.link_stylesheet, 
-			csss + (self.config.get('styles') or []))
+		return csss + [self.resolve(a) for a in self.config.get('styles') or []]
+	
+	## Get the addresses of all the scripts at the end of the page
+	# @param self		Object pointer
+	# @param multiplex	Whether the page is multiplexed
+	# @return		List of addresses, in the order they are linked
+	def scripts(self, multiplex = False):
+		return	[self.resolve(a) for a in self.config.get('scripts') or []] + \
+			(
+			# only add head.js if we actually have dependencies
+			[self.basepath + "/lib/js/head.min.js"]
+				if self.dependencies(multiplex) else []
+			) + \
+			[self.basepath + "/js/reveal.js"]
+	
+	## Resolve the address of a stylesheet or script of the presentation
+	# @param self		Object pointer
+	# @param address	Address as it is configured
+	# @return		Address to link to
+	#
+	# Addresses are linked as they are configured. Descendant classes can
+	# override this to link to, for example, compiled versions
+	def resolve(self, address):
+		return address
 	
 	## Dummy function
 	#
@@ -318,58 +503,144 @@ class Presentation:
 	def get_mdict(self, request):
 		return {}
 	
-	## Get the Reveal.js initialisation json string
+	## Dummy function
+	#
+	# This function get's overridden in HTTP_Presentation
+	def lazy_conf(self):
+		return None
+	
+	## Dummy function
+	#
+	# This function get's overridden in HTTP_Presentation
+	def offline(self):
+		return False
+	
+	## Get the Reveal.js dependencies (plugins) of the presentation
 	# @param self		Object pointer
-	# @param is_master	Whether or not the request currently being
-	#			processed is allowed to be a master
-	# @return		Reveal.js json initialisation string
-	def reveal_init_json(self, request):
+	# @param multiplex	Whether the page is multiplexed
+	# @return		List of dependency objects, in javascript, with
+	#			the basepath inserted
+	def dependencies(self, multiplex = False):
 		
-		# figure out which settings and plugin Reveal needs
-		# to do multiplexing
-		if self.do_multiplex(request):
-			mult_json = {"multiplex": self.get_mdict(request)}
-			m_plugins = [
+		plugin_list = [reveal_plugins.get(k) for k in (self.config.get('plugins') or [])]
+		
+		# add the plugins needed for multiplexing
+		if multiplex:
+			plugin_list += [
 				"{ src: '//cdn.socket.io/socket.io-1.3.5.js', async: true }",
 				"{ src: '/waterslide/multiplex.js', async: true}"
 				]
-				
+		
+		# and the one which loads the slides lazily
+		if self.lazy_conf():
+			plugin_list.append("{ src: '/waterslide/lazy.js', async: true}")
+		
+		# and the one which prefetches the media of the next slides
+		mconf = self.media_conf()
+		if mconf and mconf.prefetch:
+			plugin_list.append("{ src: '/waterslide/prefetch.js', async: true}")
+		
+		return [k.replace('{}',self.basepath) for k in plugin_list if k]
+	
+	## Get the Reveal.js initialisation json string
+	# @param self		Object pointer
+	# @param multiplex	Whether the page is multiplexed
+	# @param mdict_json	The multiplex configuration as a json string,
+	#			which is inserted as is
+	# @return		Reveal.js json initialisation string
+	def reveal_init_json(self, multiplex = False, mdict_json = 'null'):
+		
+		# the settings Reveal needs to do multiplexing get put in later
+		if multiplex:
+			mult_json = {"multiplex": None}
 		else:
 			mult_json = {}
-			m_plugins = []
+		
+		lconf = self.lazy_conf()
+		lazy_json = {"waterslideLazy": lconf._asdict()} if lconf else {}
+		
+		# the assets of the next slides are prefetched by the client
+		mconf = self.media_conf()
+		media_json = {"waterslideMedia": {
+			"prefetch": mconf.prefetch,
+			"assets": self.asset_manifest(),
+			}} if mconf and mconf.prefetch else {}
 	
 		init =	{**(self.config.get('init') or {}),
 			 **{"dependencies":[]},
 			 **mult_json,
+			 **lazy_json,
+			 **media_json,
 			 }
 			 
 		initstr = json.dumps(init, ensure_ascii=False)
 		
-		# get the full list of plugins, including those needed for multiplexing
-		plugin_list = [reveal_plugins.get(k) for k in (self.config.get('plugins') or [])] + m_plugins
-		# add the basepath where necessary, and join them JSON style (with a comma)
-		plugins = ','.join([k.replace('{}',self.basepath) 
-					for k in plugin_list  or []])
+		# join the plugins JSON style (with a comma)
+		plugins = ','.join(self.dependencies(multiplex))
+		
+		# brute force the insertion of javascript and the multiplex
+		# configuration into the object
+		return initstr \
+			.replace('"dependencies": []', "dependencies: [{}]".format(plugins)) \
+			.replace('"multiplex": null', '"multiplex": ' + mdict_json)
+	
+	## Get the presentation core, with only the first slides filled in
+	# @param self		Object pointer
+	# @param initial	Amount of slides to fill in
+	# @return		The presentation core, with placeholders for the
+	#			slides after the initial ones
+	def lazy_html_base(self, initial):
+	
+		def build():
+			out = []
+			n = 0
+			
+			for s, html in zip(self.deck.slides, self.deck.stage(stage)):
+				if s.section:
+					if n >= initial:
+						html = slides.placeholder(html, n)
+					n += 1
+				out.append(html)
+			
+			return ''.join(out)
+		
+		stage = self.render_stage
 		
-		# brute force the insertion of javascript into the object
-		return initstr.replace('"dependencies": []', "dependencies: [{}]".format(plugins))
+		return self.deck.memo(('lazy', stage, initial), build)
 	
 	## Create miscellaneous head links
 	@property
 	def misc_head_links(self):
 		return	"<link rel=\"shortcut icon\" href=\"{}\" />" \
 			.format(self.config.get('favicon', '/waterslide/logo.png'))
-	## Construct the html
+	## Get the presentation core as it is put in the html tree, utf-8 encoded
 	# @param self	Object pointer
-	# @param base	The actual presentation
-	# @return	The full html tree of the presentation
-	#
-	# This function combines all the functions which prepare bits
-	# of the presentation, such as the link generators. It also adds the
-	# the title in the head.
-	def get_html(self, request = None):
+	# @return	The encoded presentation core, which is only encoded again
+	#		when the presentation has changed
+	def encoded_html_base(self):
+		lconf = self.lazy_conf()
+		stage = self.render_stage
+		
+		if lconf:
+			return self.deck.memo(('utf-8', 'lazy', stage, lconf.initial),
+				lambda: self.lazy_html_base(lconf.initial).encode('utf-8'))
+		else:
+			return self.deck.memo(('utf-8', stage),
+				lambda: self.html_base.encode('utf-8'))
 	
-		return str.join('',
+	## Compile the page into a template
+	# @param self		Object pointer
+	# @param multiplex	Whether the page is multiplexed
+	# @return		template.Template of the page. Multiplexed pages
+	#			have a 'multiplex' hole for the encoded multiplex
+	#			configuration
+	#
+	# The head (with the links to the stylesheets) comes first, so it can be
+	# send to the browser before the (possibly huge) presentation core. The
+	# presentation core is the cached, encoded version, and is not copied.
+	def compile_page(self, multiplex = False):
+		
+		head = str.join('',
 			(
 			"<!DOCTYPE html>",
 			"<html><head><meta charset=\"utf-8\"/>",
@@ -378,29 +649,88 @@ class Presentation:
 			self.misc_head_links,
 			"</head><body>",
 			"<div class=\"reveal\"><div class=\"slides\">",
-			self.html_base,
+			)
+		)
+		
+		tail = str.join('',
+			(
 			"</div></div>",
-			self.link_resources(self.link_javascript, 
-				(self.config.get('scripts') or []) +
-				# only add head.js if we actually have plugins, or when we're multiplexing
-				([self.basepath + "/lib/js/head.min.js"]
-					if (	self.config.get('plugins') or 
-						self.do_multiplex(request)) else []) +
-				[self.basepath + "/js/reveal.js"]
-				),				
+			self.link_resources(self.link_javascript, self.scripts(multiplex)),
 			"<script>Reveal.initialize({});</script>".format(
-					self.reveal_init_json(request)
+					self.reveal_init_json(multiplex, template.hole('multiplex'))
 				),
+			# the service worker is next to the page
+			"<script>if ('serviceWorker' in navigator) " \
+				"navigator.serviceWorker.register('{}');</script>".format(sw_name)
+				if self.offline() else "",
 			"</body></html>",
 			)
 		)
+		
+		return template.Template((head, self.encoded_html_base(), tail))
+	
+	## Get the compiled page template
+	# @param self		Object pointer
+	# @param multiplex	Whether the page is multiplexed
+	# @return		template.Template of the page
+	#
+	# The page is only compiled again when the presentation has changed
+	def page_template(self, multiplex = False):
+		d, ret = self.templates.get(multiplex, (None, None))
+		digest = self.page_digest
+		
+		if d != digest:
+			ret = self.compile_page(multiplex)
+			self.templates[multiplex] = (digest, ret)
+		
+		return ret
+	
+	## Get the multiplexing configuration as encoded json
+	# @param self		Object pointer
+	# @param request	Request currently being processed
+	# @return		Encoded json object
+	def mdict_json(self, request):
+		return json.dumps(self.get_mdict(request), ensure_ascii=False).encode('utf-8')
+	
+	## Construct the html, in utf-8 encoded segments
+	# @param self		Object pointer
+	# @param request	Request currently being processed
+	# @return		Sequence of the encoded segments of the html tree
+	#
+	# Only the multiplex configuration is generated per request, the rest
+	# comes from the compiled template
+	@timing.timed('render')
+	def html_segments(self, request = None):
+		
+		if self.do_multiplex(request):
+			return self.page_template(True) \
+				.render({'multiplex': self.mdict_json(request)})
+		
+		# with several workers, the page is rendered by one of them. Its
+		# segments are kept apart, so the head is still sent first
+		if shared.store.enabled:
+			return shared.store.get_segments('page:' + (self.path or ''), self.page_digest,
+				lambda: self.page_template(False).render())
+		
+		return self.page_template(False).render()
+	
+	## Construct the html
+	# @param self		Object pointer
+	# @param request	Request currently being processed
+	# @return		The full html tree of the presentation
+	#
+	# This function combines all the functions which prepare bits
+	# of the presentation, such as the link generators. It also adds the
+	# the title in the head.
+	def get_html(self, request = None):
+		return b''.join(self.html_segments(request)).decode('utf-8')
 	
 	## Function which compiles a sass stylesheet
 	# @param self	Object pointer
 	# @param fname	File to compile
 	# @return	The compiled
 	def compile_sass(self, fname):
-		return sass.compile(filename=fname)
+		return bytes(assets.compile_sass(fname)).decode('utf-8')
 
 ## Descendant of the Presentation class, which handles presentations served over http
 #
@@ -411,7 +741,7 @@ class Presentation:
 # source file has changed.
 #
 # To keep it as framework agnostic as possible, the common_handler() method
-# uses HTTP_Request named tuples. Also, the urls passed to it should be rewritten
+# uses HTTP_Request objects. Also, the urls passed to it should be rewritten
 # to be relative to the presentation's directory
 #
 # consider /foo/bar.js within the foo presentation. The url which is then
@@ -422,6 +752,9 @@ class HTTP_Presentation(Presentation):
 	mult_randomness = None
 	mult_nosession = None
 	
+	## Maximum amount of multiplex sessions to keep the configuration of
+	mdict_depth = 256
+	
 	## Wrapper init function. Calls parent init first, then initialises multiplexing
 	def __init__(self, *args, **kwargs):
 		
@@ -462,6 +795,11 @@ class HTTP_Presentation(Presentation):
 		
 		self.mult_randomness	= multiplex.getrandom(rlen)
 		self.mult_nosession	= multiplex.getrandom(6)
+		
+		# encoded multiplex configuration per (session, master), and the
+		# (presentation digest, randomness) it is valid for
+		self.mdicts = cache.lru(self.mdict_depth)
+		self.mdicts_for = None
 	
 	## Check if a request is allowed to get multiplexing configuration
 	# @param self		Object pointer
@@ -499,11 +837,16 @@ class HTTP_Presentation(Presentation):
 	
 	## Reload the presentation into memory, if it needs to be reloaded
 	# @param self	Object pointer
+	@timing.timed('reload')
 	def reload(self):
 		
 		if self.mtimes != self.src_mtime:
-			print("Change detected")
-			self.try_import()			
+			self.try_import()
+			print("Change detected: {} of {} slides changed".format(
+				len(self.deck.delta.added), len(self.deck.slides)))
+			
+			if self.import_error:
+				print(self.path + ":", self.import_error)
 	
 	## Get the multiplexing session name
 	# @param self	Object pointer
@@ -532,18 +875,144 @@ class HTTP_Presentation(Presentation):
 			'url': self.conf.mconf.MX_server
 		}
 	
+	## Get the lazy slide delivery configuration
+	# @param self	Object pointer
+	# @return	LazyConf tuple, or None when lazy delivery is disabled
+	#
+	# Lazy delivery is enabled with the 'lazy' configuration option, which
+	# is either true or a dictionary overriding the defaults
+	def lazy_conf(self):
+		lconf = self.config.get('lazy')
+		
+		if not lconf:
+			return None
+		
+		lconf = {**lazy_defaults._asdict(), **(lconf if isinstance(lconf, dict) else {})}
+		
+		ret = LazyConf(**{k: max(int(lconf[k]), 1) for k in LazyConf._fields})
+		
+		# don't bother if all slides are in the initial page anyway
+		return ret if len(self.deck.sections) > ret.initial else None
+	
+	## Resolve the address of a stylesheet or script of the presentation
+	# @copydetails Presentation.resolve
+	#
+	# When assets are shared, files of the presentation are linked to by
+	# their shared, content addressed address
+	def resolve(self, address):
+		
+		if not self.conf.share_assets or address.startswith('/') or ':' in address:
+			return address
+		
+		fname = os.path.join(self.path, address)
+		
+		return assets.registry.address(fname) if os.path.isfile(fname) else address
+	
+	## Get the modification time of the page
+	#
+	# When assets are shared, the page changes along with the files its
+	# stylesheets and scripts resolve to
+	@property
+	def page_mtime(self):
+		
+		mtimes = [self.mtimes]
+		
+		if self.conf.share_assets:
+			for a in (self.config.get('styles') or []) + (self.config.get('scripts') or []):
+				fname = os.path.join(self.path, a)
+				
+				if not (a.startswith('/') or ':' in a) and os.path.isfile(fname):
+					mtimes.append(assets.mtime(fname))
+		
+		return max(mtimes)
+	
+	## Whether the presentation is available offline
+	#
+	# It is enabled with the 'offline' configuration option, which serves a
+	# service worker that precaches the presentation
+	def offline(self):
+		return bool(self.config.get('offline'))
+	
+	## Get the manifest of the files the service worker precaches
+	# @param self	Object pointer
+	# @return	Dictionary of the address of each file, relative to the
+	#		presentation, and its content hash
+	#
+	# Files of the presentation itself are hashed by their content, other
+	# addresses (the Reveal.js provider, for example) by their address,
+	# which is taken to be versioned. The page is hashed by the
+	# presentation's digest, and the chunks of lazily loaded slides by the
+	# slides in them.
+	def offline_manifest(self):
+		
+		deps = [m.group(3) for d in self.dependencies() for m in plugin_src.finditer(d)]
+		media = [a for section in self.asset_manifest() for a in section]
+		
+		manifest = {'./': self.page_digest}
+		
+		for address in self.stylesheets + self.scripts() + deps + media:
+			
+			if address in manifest or address.startswith('data:'):
+				continue
+			
+			# addresses relative to the presentation
+			if not (address.startswith('/') or ':' in address):
+				fname = os.path.join(self.path, address.split('?')[0].split('#')[0])
+				
+				if os.path.isfile(fname):
+					manifest[address] = httputils.file_digest(fname)
+			else:
+				manifest[address] = slides.digest(address)
+		
+		# lazy.js fetches the chunks aligned on the chunk size
+		lconf = self.lazy_conf()
+		
+		if lconf:
+			sections = self.deck.section_stage(self.render_stage)
+			
+			for first in range(lconf.initial - lconf.initial % lconf.chunk,
+						len(sections), lconf.chunk):
+				manifest['?slides={}-{}'.format(first, first + lconf.chunk)] = \
+					slides.digest(''.join(sections[first:first + lconf.chunk]))
+		
+		return manifest
+	
+	## Get the multiplexing configuration as encoded json
+	# @copydetails Presentation.mdict_json
+	#
+	# During the start of a talk many clients request the same session at
+	# once, so the configuration (and the hashing of the socket ID) is cached
+	# per session. The cache is dropped when the presentation changes, or
+	# when the randomness has been changed.
+	def mdict_json(self, request):
+		
+		valid_for = (self.digest, self.mult_randomness)
+		
+		if self.mdicts_for != valid_for:
+			self.mdicts.clear()
+			self.mdicts_for = valid_for
+		
+		key = (self.get_session_name(request),
+			request.url.query.get('master') != None)
+		
+		return self.mdicts.get(key, lambda: super(HTTP_Presentation, self).mdict_json(request))
+	
 	## Figure out the handler needed to process the current request
 	# @param self		Object pointer
+	# @param path		Path of the request, relative to the presentation
 	# @param request	Request currently being processed
-	# @param url		urlparse()-ed url
 	# @return	Function pointer, or None on failure
 	#
 	# It figures out the request handler based upon the url, and the
 	# the extension of the url
-	def figure_handler(self, path):
+	def figure_handler(self, path, request = None):
 			
 		if path == "":
+			if request and 'slides' in request.url.query:
+				return self.send_slides
 			return self.send_html
+		elif path == sw_name and self.offline():
+			return self.send_worker
 		elif os.path.exists(os.path.join(self.path, path)):
 			
 			ext = os.path.splitext(path)[1]
@@ -557,7 +1026,7 @@ class HTTP_Presentation(Presentation):
 	
 	## Request entry point method
 	# @param self		Object pointer
-	# @param request	Request currently being processed (HTTP_Request tuple)
+	# @param request	Request currently being processed (HTTP_Request)
 	#
 	# This function is the main entry point for any request with its url
 	# being within the presentation root. The path must be normalised to
@@ -567,8 +1036,11 @@ class HTTP_Presentation(Presentation):
 	@httputils.aio_translate(rewrite = lambda r:r.match_info['tail'],
 					logger = httputils.log_request)
 	def handle(self, request):
-	
-		return (self.figure_handler(request.url.path))(request.url.path, request)
+		
+		with timing.phase('dispatch'):
+			handler = self.figure_handler(request.url.path, request)
+		
+		return handler(request.url.path, request)
 		
 	## Request handler for sending files directly from disk
 	# @param self		Object pointer
@@ -591,15 +1063,18 @@ class HTTP_Presentation(Presentation):
 		
 		fname = os.path.join(self.path, path)
 	
-		cached = httputils.client_has_cached(fname, request, self.conf.cache)
+		# the content type is set for HEAD requests as well
+		cached = httputils.client_has_cached(fname, request, self.conf.cache,
+			content_type = mimetypes.guess_type(fname)[0] or 'application/octet-stream')
 	
 		if cached.code == 304:
 			return cached
 		
-		with open(fname, 'rb') as f:
-			ctnt = f.read()
+		if request.method == 'HEAD':
+			return httputils.head_response(cached, os.path.getsize(fname))
 		
-		return httputils.HTTP_Response(code = 200, headers = cached.headers, body = ctnt)
+		# frequently requested files are kept in memory
+		return cached._replace(body = httputils.static_files.get(fname))
 
 	## Request handler for sass/scss stylesheets
 	# @copydetails HTTP_Presentation.send_direct
@@ -607,20 +1082,14 @@ class HTTP_Presentation(Presentation):
 	
 		fname = os.path.join(self.path, path)
 	
-		cached = httputils.client_has_cached(fname, request, self.conf.cache)
-		if cached.code == 304:
-			return cached
+		# the stylesheet changes along with the stylesheets it imports
+		cached = httputils.client_has_cached(fname, request, self.conf.cache,
+			mtime = assets.mtime(fname), content_type = 'text/css')
 		
-		ctnt = self.compile_sass(fname)
+		if cached.code == 304 or request.method == 'HEAD':
+			return httputils.head_response(cached)
 		
-		return httputils.HTTP_Response(
-			code = 200, 
-			headers = {
-				**cached.headers,
-				'Content-type':'text/css'
-				},
-			body = ctnt
-			)
+		return cached._replace(body = assets.compile_sass(fname))
 	
 	## Request handler for when a resource is not found
 	# @copydetails HTTP_Presentation.send_direct
@@ -678,7 +1147,8 @@ class HTTP_Presentation(Presentation):
 
 		# only cache the html when we're not multiplexing
 		if not self.do_multiplex(request):
-			cached = httputils.client_has_cached(fname, request, do_cache = self.conf.cache, mtime = self.mtimes)
+			cached = httputils.client_has_cached(fname, request, do_cache = self.conf.cache,
+				mtime = self.page_mtime, content_type = 'text/html; charset=utf-8')
 			if cached.code == 304:
 				return cached
 		else:
@@ -686,21 +1156,94 @@ class HTTP_Presentation(Presentation):
 			if auth.code == 401:
 				return auth
 			
-			cached = httputils.HTTP_Response(code = 200, headers = {}, body = "")
+			cached = httputils.uncached_response('text/html; charset=utf-8')
+		
+		if request.method == 'HEAD':
+			return httputils.head_response(cached)
+		
+		# send the segments as they are, which streams them to the client
+		return cached._replace(body = self.html_segments(request))
+
+	## Request handler for a chunk of lazily loaded slides
+	# @copydetails HTTP_Presentation.send_direct
+	#
+	# The chunk is requested with the 'slides' query parameter, in the form
+	# of '<first>-<last>' (exclusive), and is send as a json list of the
+	# sections' markup. It is cached and validated like the main page.
+	def send_slides(self, url, request):
+		
+		fname = os.path.join(self.path, "index.html")
+		
+		self.reload()
+		
+		lconf = self.lazy_conf()
+		
+		try:
+			first, last = (int(i) for i in request.url.query.get('slides').split('-', 1))
+		except (AttributeError, ValueError):
+			lconf = None
+		
+		if not lconf or first < 0 or last < first:
+			return httputils.HTTP_Response(
+				code = 400,
+				headers = {},
+				body = "400 Bad Request: invalid slide range"
+				)
+		
+		cached = httputils.client_has_cached(fname, request, do_cache = self.conf.cache,
+			mtime = self.mtimes, content_type = 'application/json')
+		if cached.code == 304 or request.method == 'HEAD':
+			return httputils.head_response(cached)
+		
+		# never send more than a chunk at once
+		sections = self.deck.section_stage(self.render_stage)[first:min(last, first + lconf.chunk)]
+		
+		return cached._replace(body = json.dumps(sections, ensure_ascii=False))
+
+	## Request handler for the offline service worker
+	# @copydetails HTTP_Presentation.send_direct
+	#
+	# The worker is the generic worker from the web resources, preceded by
+	# the manifest of the presentation and its version. Browsers compare the
+	# worker byte for byte when checking for updates, so a new version is
+	# installed whenever any entry of the manifest changes.
+	def send_worker(self, path, request):
+		
+		self.reload()
+		
+		manifest = self.offline_manifest()
+		version = slides.digest(json.dumps(manifest, sort_keys = True))
+		
+		with open(os.path.join(os.path.split(__file__)[0], 'web-resources', 'offline.js'), 'r') as f:
+			worker = f.read()
 		
 		return httputils.HTTP_Response(
-			code = 200, 
+			code = 200,
 			headers = {
-				**cached.headers,
-				'Content-type':'text/html'
+				'Content-type':'application/javascript',
+				'Cache-Control':'no-cache',
 				},
-			body = self.get_html(request)
+			body = 'var version = {};\nvar manifest = {};\n{}'.format(
+				json.dumps(version), json.dumps(manifest, sort_keys = True), worker)
 			)
 
 class managed_pres(HTTP_Presentation):
 	
 	def handle(self, request):
-		return self.send_html('', request)
+		path = sw_name if request.url.path.endswith('/' + sw_name) else ''
+		
+		return self.figure_handler(path, request)(path, request)
+
+## Load a single presentation, and time how long it took
+# @param path		Path to the presentation
+# @param conf		Presentation configuration
+# @param ptype		Presentation type to initialise
+# @return		Tuple of the presentation object and the load time in seconds
+def timed_load(path, conf, ptype = HTTP_Presentation):
+	t = time.perf_counter()
+	obj = ptype(path, conf)
+
+	return obj, time.perf_counter() - t
 
 ## load a list of paths which might be presentations into a dictionary or list, depending on the assoc arg
 #
@@ -709,23 +1252,48 @@ class managed_pres(HTTP_Presentation):
 # @param ptype		Presentation type to initialise
 # @param assoc		To associate the object with something, and if so, what (currently recognised
 # 			are "slug" and "title"
-def loadl(l, conf, ptype = HTTP_Presentation, assoc = None):
+# @param workers	Amount of threads used to load the presentations. Uses
+#			the executor's default when None
+# @param verbosity	0: silent, 1: errors and a summary line, 2: also show the
+#			load time of each presentation
+#
+# The presentations are loaded concurrently, since loading them is mostly
+# file reads and yaml parsing. The order of the list is preserved.
+def loadl(l, conf, ptype = HTTP_Presentation, assoc = None, workers = None, verbosity = 1):
 	if assoc == None:
 		preslist = []
 	else:
 		preslist = {}
 	
-	for presentation_path in l:
-		obj = ptype(presentation_path, conf)
+	t = time.perf_counter()
+	failed = 0
+	
+	with futures.ThreadPoolExecutor(max_workers = workers) as executor:
+		loaded = executor.map(lambda path: timed_load(path, conf, ptype), l)
+	
+		for presentation_path, (obj, dt) in zip(l, loaded):
 		
-		if obj.isreal:
+			if verbosity >= 2:
+				print(" {:8.1f} ms  {}".format(dt * 1000, presentation_path))
+		
+			if not obj.isreal:
+				failed += 1
+				if verbosity > 0:
+					print("Could not load {}: {}".format(presentation_path,
+						obj.import_error or 'not a presentation'))
+				continue
+			
 			if assoc == "slug":
-				preslist[obj.assoc] = obj
+				preslist[obj.slug] = obj
 			elif assoc == "title":
 				preslist[obj.title] = obj
 			else:
 				preslist.append(obj)
 	
+	if verbosity > 0 and len(l) > 1:
+		print("loaded {} of {} presentations in {:.2f} s".format(
+			len(l) - failed, len(l), time.perf_counter() - t))
+	
 	return preslist
 
 ## @}
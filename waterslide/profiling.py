@@ -0,0 +1,219 @@
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import gc
+import sys
+import mmap
+import time
+import types
+import signal
+import asyncio
+import cProfile
+import tracemalloc
+from waterslide import metrics
+
+##
+#  @defgroup profiling On-demand profiling module
+#
+# Profiles a running server when it receives a signal, so hot spots can be
+# found where they occur instead of being reproduced locally. Only the user
+# running the server (and root) can signal it, so no further authentication is
+# needed.
+#
+# - SIGUSR1 profiles the event loop with cProfile for a number of seconds, and
+#   writes the result as a pstats file. It can be inspected with the pstats
+#   module, or turned into a flame graph with tools like flameprof.
+# - SIGUSR2 measures the memory used by each cache (the presentations of the
+#   manager, compiled stylesheets, static files, ...), and writes a report.
+#   When tracemalloc is tracing (start the server with PYTHONTRACEMALLOC=1),
+#   a snapshot of it is written too, and the report lists the lines which
+#   allocated the most memory.
+#
+# The files are written to the directory given with the --profiling option, and
+# named after the process, so the workers of a server don't overwrite each
+# other's files. Signalling the parent process of the workers signals all
+# of them.
+#
+#  @addtogroup profiling
+#  @{
+#
+
+## Objects which are shared by the whole program, and not part of any cache
+boundaries = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+	types.MethodType, types.CodeType, types.FrameType)
+
+## Measure the memory used by objects and everything they refer to
+# @param roots	Iterable of the objects
+# @param seen	Set of the ids of the objects which were already measured,
+#		which is updated
+# @return	(bytes on the heap, bytes of mapped files)
+#
+# Objects referred to by several caches are counted with the first cache
+# measured.
+def measure(roots, seen):
+	size = 0
+	mapped = 0
+	stack = list(roots)
+
+	while stack:
+		obj = stack.pop()
+
+		if id(obj) in seen or isinstance(obj, boundaries):
+			continue
+
+		seen.add(id(obj))
+		size += sys.getsizeof(obj)
+
+		if isinstance(obj, mmap.mmap) and not obj.closed:
+			mapped += len(obj)
+
+		stack.extend(gc.get_referents(obj))
+
+	return size, mapped
+
+## Profiler of a running server
+class Profiler():
+
+	## @param self		Object pointer
+	# @param directory	Directory the results are written to
+	# @param seconds	Duration of a cProfile session
+	def __init__(self, directory, seconds = 30):
+		self.directory = directory
+		self.seconds = seconds
+		## cProfile session which is running, or None
+		self.profiler = None
+		self.app = None
+
+	## Get the name of a file to write a result to
+	# @param self	Object pointer
+	# @param kind	Kind of the result
+	# @param ext	Extension of the file
+	def filename(self, kind, ext):
+		return os.path.join(self.directory, 'waterslide-{}-{}-{}.{}'.format(
+			os.getpid(), time.strftime('%Y%m%d-%H%M%S'), kind, ext))
+
+	## Start a cProfile session, which stops by itself
+	# @param self	Object pointer
+	def profile(self):
+		if self.profiler:
+			print("Already profiling")
+			return
+
+		print("Profiling for {} seconds".format(self.seconds))
+
+		self.profiler = cProfile.Profile()
+		self.profiler.enable()
+
+		asyncio.get_event_loop().call_later(self.seconds, self.finish)
+
+	## Stop the cProfile session, and write its result
+	# @param self	Object pointer
+	def finish(self):
+		if not self.profiler:
+			return
+
+		self.profiler.disable()
+		fname = self.filename('cpu', 'pstats')
+
+		try:
+			self.profiler.dump_stats(fname)
+			print("Wrote profile to", fname)
+		except OSError as e:
+			print("Could not write profile:", e)
+
+		self.profiler = None
+
+	## Get the memory used by each cache
+	# @param self	Object pointer
+	# @return	List of (name, entries, bytes, mapped bytes)
+	def caches(self):
+		seen = set()
+		ret = []
+
+		named = sorted((name, func()) for name, func in metrics.cache_contents.items())
+
+		# the presentations of the serve subcommand aren't kept in a cache
+		if self.app is not None and 'dispatcher' in self.app:
+			named.insert(0, ('presentations', self.app['dispatcher'].presentations))
+
+		for name, contents in named:
+			size, mapped = measure([contents], seen)
+			ret.append((name, len(contents), size, mapped))
+
+		return ret
+
+	## Write a report of the memory used by the caches
+	# @param self	Object pointer
+	def snapshot(self):
+		fname = self.filename('memory', 'txt')
+		lines = ['{:<24} {:>8} {:>12} {:>12}'.format('cache', 'entries', 'bytes', 'mapped')]
+
+		for name, entries, size, mapped in self.caches():
+			lines.append('{:<24} {:>8} {:>12} {:>12}'.format(name, entries, size, mapped))
+
+		if tracemalloc.is_tracing():
+			snap = tracemalloc.take_snapshot()
+			snap.dump(self.filename('memory', 'tracemalloc'))
+
+			lines += ['', 'Top allocations:']
+			lines += [str(s) for s in snap.statistics('lineno')[:25]]
+		else:
+			lines += ['', 'tracemalloc is not tracing, set PYTHONTRACEMALLOC=1 to trace allocations']
+
+		try:
+			with open(fname, 'w') as f:
+				f.write('\n'.join(lines) + '\n')
+			print("Wrote memory report to", fname)
+		except OSError as e:
+			print("Could not write memory report:", e)
+
+	## Listen for the signals
+	# @param self	Object pointer
+	# @param app	Web application which is starting
+	async def start(self, app):
+		loop = asyncio.get_event_loop()
+
+		self.app = app
+		loop.add_signal_handler(signal.SIGUSR1, self.profile)
+		loop.add_signal_handler(signal.SIGUSR2, self.snapshot)
+
+	## Stop listening, writing the result of a running session
+	# @param self	Object pointer
+	# @param app	Web application which is shutting down
+	async def stop(self, app):
+		loop = asyncio.get_event_loop()
+
+		loop.remove_signal_handler(signal.SIGUSR1)
+		loop.remove_signal_handler(signal.SIGUSR2)
+		self.finish()
+
+	## Profile a web application on request while it runs
+	# @param self	Object pointer
+	# @param app	Web application, which hasn't started yet
+	def setup(self, app):
+		os.makedirs(self.directory, exist_ok = True)
+
+		app.on_startup.append(self.start)
+		app.on_cleanup.append(self.stop)
+		return self
+
+## Forward the profiling signals to worker processes
+# @param pids	Process ids of the workers
+def forward(pids):
+
+	def handler(signum, frame):
+		for pid in pids:
+			try:
+				os.kill(pid, signum)
+			except ProcessLookupError:
+				pass
+
+	signal.signal(signal.SIGUSR1, handler)
+	signal.signal(signal.SIGUSR2, handler)
+
+## @}
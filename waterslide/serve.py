@@ -8,10 +8,13 @@
 from sys import argv
 import os
 import re
+import signal
+import socket
+import asyncio
 from urllib.parse import urlparse, urlunparse
 from aiohttp import web
 
-from waterslide import presentation, multiplex, httputils
+from waterslide import presentation, multiplex, httputils, shared, profiling, accesslog
 
 ##
 #  @defgroup serve HTTP server module
@@ -47,6 +50,54 @@ def presentation_need_locals(presses):
 def redirect(request):
 	return web.HTTPFound('/' + request.match_info['pres'] + '/?' + request.query_string)
 
+## Single route dispatcher for presentations served under their slug
+#
+# Instead of registering a route per presentation (which aiohttp resolves by
+# scanning all of them in order), one route extracts the first path segment
+# and looks the presentation up in a dictionary. Presentations can be added
+# and removed at runtime without touching the router.
+class Dispatcher():
+
+	def __init__(self, preslist = ()):
+		self.presentations = {}
+
+		for p in preslist:
+			self.add(p)
+
+	## Add a presentation, replacing any presentation with the same slug
+	# @param self	Object pointer
+	# @param p	Presentation to add
+	def add(self, p):
+		self.presentations[p.slug] = p
+		return p
+
+	## Remove a presentation by its slug
+	# @param self	Object pointer
+	# @param slug	Slug of the presentation to remove
+	# @return	The removed presentation, or None if it wasn't served
+	def remove(self, slug):
+		return self.presentations.pop(slug, None)
+
+	## Request entry point, hands the request to the presentation
+	# @param self		Object pointer
+	# @param request	Request object (currently for an aiohttp server)
+	def handle(self, request):
+		p = self.presentations.get(request.match_info['pres'])
+
+		if p is None:
+			return web.Response(status = 404, body = 'Resource not found')
+
+		return p.handle(request)
+
+	## Redirect requests for a presentation without trailing slash,
+	# but only for presentations we actually serve
+	# @copydetails Dispatcher.handle
+	def redirect(self, request):
+		if request.match_info['pres'] not in self.presentations:
+			return web.Response(status = 404, body = 'Resource not found')
+
+		return redirect(request)
+
 ## Function to send a 403 forbidden status
 # @param msg	message to be send
 # @return	Redirect response for an aiohttp webserver
@@ -62,11 +113,31 @@ class SConf():
 		port	= 9090,
 		single	= False,
 		local_reveal = None,
+		workers	= 1,
+		metrics	= False,
+		server_timing = True,
+		log_timing = False,
+		loop_monitor = None,
+		profiling = None,
+		profile_seconds = 30,
+		log_format = 'text',
+		log_sample = 1.0,
+		log_queue = 10000,
 	):
 		self.address	= address
 		self.port	= port
 		self.single	= single
 		self.local_reveal = local_reveal
+		self.workers	= workers
+		self.metrics	= metrics
+		self.server_timing = server_timing
+		self.log_timing = log_timing
+		self.loop_monitor = loop_monitor
+		self.profiling	= profiling
+		self.profile_seconds = profile_seconds
+		self.log_format	= log_format
+		self.log_sample	= log_sample
+		self.log_queue	= log_queue
 
 	helptext = '''
 -p, --port <port>       Port for the webserver to listen to
@@ -75,11 +146,35 @@ class SConf():
 -s, --single            Serve a single presentation in its own directory,
                         instead of directly in the root directory
 -l, --local <path>      Path to a local Reveal repository.
+-w, --workers <n>       Amount of worker processes to serve with (1 is the
+                        default). Rendered pages and stylesheets are shared
+                        between them. Cannot be combined with the built-in
+                        multiplex server
+--metrics               Expose request, cache and compile metrics under
+                        /waterslide/metrics, in the Prometheus text format
+--no-server-timing      Do not send the time spent in each phase of handling
+                        a request in a Server-Timing header
+--log-timing            Log the time spent in each phase of handling a request,
+                        including writing streamed pages, which isn't in the
+                        Server-Timing header
+--loop-monitor <ms>     Measure the lag of the event loop, and log which
+                        function blocked it when it was blocked for longer
+                        than <ms> milliseconds
+--profiling <dir>       Write a cProfile profile of the next seconds on
+                        SIGUSR1, and a report of the memory used by the caches
+                        on SIGUSR2, into <dir>
+--profile-seconds <s>   Duration of a profile (30 is the default)
+--log-format <fmt>      Format of the access log: text (the default),
+                        combined or json
+--log-sample <frac>     Fraction of the successful requests to log (1 is the
+                        default). Failed requests are always logged
+--log-queue <n>         Amount of access log records which may wait to be
+                        written, before they're dropped (10000 is the default)
 '''
 
 	def parse(self, argn):
 		if argv[argn] in ("-p", "--port"):
-			self.port = int(args.argv[argn+1])
+			self.port = int(argv[argn+1])
 			ret = 2
 		elif argv[argn] in ("-a", "--addresses"):
 			self.address = argv[argn+1]
@@ -90,6 +185,39 @@ class SConf():
 		elif argv[argn] in ("-l", "--local"):
 			self.reveal_local = find_local_reveal([argv[argn+1]], False)
 			ret = 1
+		elif argv[argn] in ("-w", "--workers"):
+			self.workers = max(int(argv[argn+1]), 1)
+			ret = 2
+		elif argv[argn] == "--metrics":
+			self.metrics = True
+			ret = 1
+		elif argv[argn] == "--no-server-timing":
+			self.server_timing = False
+			ret = 1
+		elif argv[argn] == "--log-timing":
+			self.log_timing = True
+			ret = 1
+		elif argv[argn] == "--loop-monitor":
+			self.loop_monitor = float(argv[argn+1]) / 1000
+			ret = 2
+		elif argv[argn] == "--profiling":
+			self.profiling = argv[argn+1]
+			ret = 2
+		elif argv[argn] == "--profile-seconds":
+			self.profile_seconds = float(argv[argn+1])
+			ret = 2
+		elif argv[argn] == "--log-format":
+			if argv[argn+1] in accesslog.formats:
+				self.log_format = argv[argn+1]
+			else:
+				print("Unknown log format", argv[argn+1])
+			ret = 2
+		elif argv[argn] == "--log-sample":
+			self.log_sample = float(argv[argn+1])
+			ret = 2
+		elif argv[argn] == "--log-queue":
+			self.log_queue = int(argv[argn+1])
+			ret = 2
 		
 		else:
 			return 0
@@ -126,12 +254,17 @@ def run(preslist, verbosity=1, sconf = None, mconf = None, pconf = None):
 	if len(preslist) == 1 and not sconf.single:
 		def add(p):
 			app.router.add_route('GET', '/{tail:.*}', preslist[0].handle)
+			app.router.add_route('HEAD', '/{tail:.*}', preslist[0].handle)
 			show(p, '/')
 	else:
-		# add the redirect route
-		app.router.add_route('GET', '/{pres}', redirect)
+		# route everything through a single dispatcher, which resolves
+		# the presentation by its slug
+		dispatcher = app['dispatcher'] = Dispatcher()
+		for method in ('GET', 'HEAD'):
+			app.router.add_route(method, '/{pres}', dispatcher.redirect)
+			app.router.add_route(method, '/{pres}/{tail:.*}', dispatcher.handle)
 		def add(p):
-			app.router.add_route('GET', '/' + p.slug + '/{tail:.*}', p.handle)
+			dispatcher.add(p)
 			show(p, '/' + p.slug + '/')
 
 	# define an output function to show the presentation configuration,
@@ -153,8 +286,125 @@ def run(preslist, verbosity=1, sconf = None, mconf = None, pconf = None):
 	# add the presenatations to the app
 	for p in preslist:
 		add(p)
+	
+	start(app, sconf, mconf)
+
+## Run the webapp, in one or more worker processes
+# @param app	Web application to run
+# @param sconf	Server configuration object
+# @param mconf	Multiplex configuration object
+#
+# Workers are forked after the presentations have been loaded, and accept
+# connections on the same socket. The built-in multiplex server keeps its
+# clients in memory, so it needs to run in a single process.
+#
+# Terminating the parent (SIGTERM, SIGHUP) terminates the workers as well, and
+# workers stop by themselves when the parent is gone, so they never outlive
+# the shared store.
+def start(app, sconf, mconf = None):
+	
+	if sconf.workers == 1:
+		web.run_app(app, host=sconf.address, port=sconf.port)
+		return
+	
+	if mconf and mconf.startserver:
+		print("The multiplex server cannot be run with more than one worker")
+		return False
+	
+	sock = socket.socket(socket.AF_INET6 if ':' in sconf.address else socket.AF_INET)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	sock.bind((sconf.address, sconf.port))
+	sock.listen(128)
+	
+	shared.store.create()
+	print("Serving with {} workers".format(sconf.workers))
+	
+	pids = []
+	stops = (signal.SIGTERM, signal.SIGHUP)
+	
+	def stop(signum, frame):
+		for pid in pids:
+			try:
+				os.kill(pid, signum)
+			except ProcessLookupError:
+				pass
+		
+		raise SystemExit(128 + signum)
+	
+	def reap():
+		for pid in pids:
+			try:
+				os.waitpid(pid, 0)
+			except ChildProcessError:
+				pass
+	
+	try:
+		for sig in stops:
+			signal.signal(sig, stop)
+		
+		for i in range(sconf.workers):
+			# a signal arriving while forking is handled once the
+			# worker has been added to pids
+			signal.pthread_sigmask(signal.SIG_BLOCK, stops)
+			pid = os.fork()
+			
+			if pid == 0:
+				for sig in stops:
+					signal.signal(sig, signal.SIG_DFL)
+				signal.pthread_sigmask(signal.SIG_UNBLOCK, stops)
+				
+				try:
+					worker(app, sock, i == 0)
+				finally:
+					os._exit(0)
+			
+			pids.append(pid)
+			signal.pthread_sigmask(signal.SIG_UNBLOCK, stops)
 		
-	web.run_app(app, host=sconf.address, port=sconf.port)
+		# signalling the parent profiles all the workers
+		if sconf.profiling:
+			profiling.forward(pids)
+		
+		try:
+			reap()
+		# the workers get the interrupt too, wait for them to exit
+		except KeyboardInterrupt:
+			reap()
+	except SystemExit:
+		# the workers have been signalled already
+		for sig in stops:
+			signal.signal(sig, signal.SIG_IGN)
+		
+		reap()
+		raise
+	finally:
+		for sig in stops:
+			signal.signal(sig, signal.SIG_DFL)
+		
+		shared.store.close()
+
+## Run the webapp in a worker process
+# @param app	Web application to run
+# @param sock	Socket to accept connections on
+# @param first	Whether this is the first worker, which prints the banner
+#
+# The worker stops (as it does on SIGTERM) when its parent is gone.
+def worker(app, sock, first):
+	# the event loop of the parent can't be shared
+	loop = asyncio.new_event_loop()
+	asyncio.set_event_loop(loop)
+	parent = os.getppid()
+	
+	def orphaned():
+		if os.getppid() != parent:
+			os.kill(os.getpid(), signal.SIGTERM)
+		else:
+			loop.call_later(1, orphaned)
+	
+	loop.call_soon(orphaned)
+	
+	web.run_app(app, sock = sock, loop = loop,
+		print = print if first else lambda *args: None)
 
 ## Serve subcommand
 # @param argn	Argument where "Main" stopped parsing
@@ -181,7 +431,10 @@ Options:
                         presentation needs a locally served repository but it
                         is not configured (i.e.: We've got this, don't worry)
 
--v, --verbose           Be verbose
+-j, --jobs <n>          Amount of threads used to load the presentations
+
+-v, --verbose           Be verbose, also shows the load time of each
+                        presentation
 -z, --silent            Be silent
 
 -h, --help              Show this helptext
@@ -199,6 +452,9 @@ Options:
 	
 	verbose = 1
 	
+	# amount of threads used to load presentations, None for the default
+	jobs = None
+	
 	# presenatation configuration object
 	pconf = presentation.PConf()
 	sconf = SConf()
@@ -221,6 +477,9 @@ Options:
 			verbose = 2
 		elif argv[i] in ("-z", "--silent"):
 			verbose = 0
+		elif argv[i] in ("-j", "--jobs"):
+			jobs = int(argv[i+1])
+			i += 1
 
 		elif argv[i] in ("--local-configured",):
 			local_configured = True
@@ -252,6 +511,8 @@ Options:
 			pconf,
 			ptype = presentation.HTTP_Presentation,
 			assoc = None,
+			workers = jobs,
+			verbosity = verbose,
 			)
 			
 
@@ -0,0 +1,303 @@
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import mmap
+import shutil
+import hashlib
+import tempfile
+from collections import namedtuple
+from waterslide import metrics, cache
+
+##
+#  @defgroup shared Shared artifact module
+#
+# When serving with several worker processes, artifacts which are expensive to
+# produce (rendered pages, compiled stylesheets) are stored in a directory in
+# shared memory (/dev/shm, when available). The first worker which needs an
+# artifact produces and stores it, the others map the stored file, so all of
+# them read the same pages of memory without copying them.
+#
+# Artifacts have a name and a version (a content hash of their sources). Each
+# name has an index file pointing to the artifact of its latest version, and
+# storing a new version removes the previous one. Workers which still have the
+# old version mapped can keep using it, but won't find it anymore once their
+# sources have changed too.
+#
+# Each worker keeps the artifacts it mapped by name, one version per name, in a
+# bounded cache. Asking for another version of a name drops the mapping of the
+# version it had.
+#
+# An artifact can also be published under an alias (a content hash, for
+# example), for workers which only know that. The alias of a version is
+# removed along with it, and several names can have the same alias.
+#
+#  @addtogroup shared
+#  @{
+#
+
+## Status of a Store
+SStats = namedtuple('SStats', ['hits', 'shared', 'misses', 'entries'])
+
+## Hash a string
+def digest(text):
+	return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+## Store of artifacts shared between worker processes
+#
+# A store without a directory is disabled, and produces the artifacts every
+# time they're requested.
+class Store():
+
+	## @param self	Object pointer
+	# @param depth	Maximum amount of artifacts to keep mapped
+	def __init__(self, depth = 1024):
+		## Directory the artifacts are stored in, None when disabled
+		self.directory = None
+		## Whether this process created (and removes) the directory
+		self.owner = False
+		# name -> (version, memoryview)
+		self.local = cache.lru(depth)
+		## Artifacts this process had already mapped
+		self.hits = 0
+		## Artifacts which were produced by another process
+		self.shared = 0
+		## Artifacts which were produced by this process
+		self.misses = 0
+
+	## Whether artifacts are shared
+	@property
+	def enabled(self):
+		return self.directory is not None
+
+	## Create a directory for the store, and use it
+	# @param self	Object pointer
+	#
+	# Worker processes forked after this use the same directory
+	def create(self):
+		base = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+		self.directory = tempfile.mkdtemp(prefix = 'waterslide-', dir = base)
+		self.owner = True
+		os.mkdir(os.path.join(self.directory, 'names'))
+		os.mkdir(os.path.join(self.directory, 'aliases'))
+
+	## Stop using the store, removing its directory if this process created it
+	def close(self):
+		if self.owner:
+			shutil.rmtree(self.directory, ignore_errors = True)
+
+		self.directory = None
+		self.owner = False
+		self.local.clear()
+
+	## Get an artifact
+	# @param self		Object pointer
+	# @param name		Name of the artifact (string)
+	# @param version	Version of the artifact (string)
+	# @param func		Callable without arguments which produces the
+	#			artifact as bytes, when no worker has done so yet
+	# @param alias		Alias to publish this version under, or None
+	# @return		bytes-like object containing the artifact
+	def get(self, name, version, func, alias = None):
+		if not self.enabled:
+			return func()
+
+		view = self.lookup(name, version)
+
+		if view is None:
+			key = self.publish(name, version, func(), alias)
+			view = self.map(os.path.join(self.directory, key))
+			self.local.put(name, (version, view))
+			self.misses += 1
+
+		return view
+
+	## Get an artifact made of several segments
+	# @param self		Object pointer
+	# @param name		Name of the artifact (string)
+	# @param version	Version of the artifact (string)
+	# @param func		Callable without arguments which produces the
+	#			segments, as a sequence of bytes-like objects
+	# @return		Tuple of the segments, as bytes-like objects
+	#
+	# The segments are stored as one artifact, preceded by a line with their
+	# lengths, and are returned as views into it. They can still be sent one
+	# by one (the head of a page before the rest, for example).
+	def get_segments(self, name, version, func):
+		if not self.enabled:
+			return tuple(func())
+
+		ver, segments = self.local.peek(name, (None, None))
+
+		if ver == version:
+			self.hits += 1
+			return segments
+
+		def pack():
+			segments = func()
+			return b' '.join(str(len(s)).encode('ascii') for s in segments) + b'\n' + \
+				b''.join(segments)
+
+		view = self.get(name, version, pack)
+
+		# the lengths line is short, and only read when the artifact is mapped
+		end = 0
+		while view[end] != 0x0a:
+			end += 1
+
+		segments = []
+		pos = end + 1
+
+		for length in bytes(view[:end]).split():
+			segments.append(view[pos:pos + int(length)])
+			pos += int(length)
+
+		segments = tuple(segments)
+		self.local.put(name, (version, segments))
+
+		return segments
+
+	## Get an artifact, if any worker has produced it
+	# @param self		Object pointer
+	# @param name		Name of the artifact
+	# @param version	Version of the artifact
+	# @return		bytes-like object containing the artifact, or
+	#			None when it isn't there
+	def lookup(self, name, version):
+		if not self.enabled:
+			return None
+
+		ver, view = self.local.peek(name, (None, None))
+
+		if ver == version:
+			self.hits += 1
+			return view
+
+		# the version this process had is outdated, whether or not the
+		# requested one is there
+		if ver is not None:
+			self.local.drop(name)
+
+		try:
+			view = self.map(os.path.join(self.directory, digest(name + '\0' + version)))
+		except FileNotFoundError:
+			return None
+
+		self.local.put(name, (version, view))
+		self.shared += 1
+
+		return view
+
+	## Get an artifact by its alias, if any worker has published it
+	# @param self	Object pointer
+	# @param alias	Alias of the artifact
+	# @return	bytes-like object containing the artifact, or None when
+	#		no current version has the alias
+	def lookup_alias(self, alias):
+		if not self.enabled:
+			return None
+
+		d = os.path.join(self.directory, 'aliases', digest(alias))
+
+		try:
+			entries = os.listdir(d)
+		except FileNotFoundError:
+			return None
+
+		for e in entries:
+			try:
+				with open(os.path.join(d, e), 'r', encoding = 'utf-8') as f:
+					version, name = f.read().split('\n', 1)
+			except (FileNotFoundError, ValueError):
+				continue
+
+			view = self.lookup(name, version)
+
+			if view is not None:
+				return view
+
+		return None
+
+	## Map a stored artifact
+	# @param fname	File of the artifact
+	# @return	memoryview of the artifact
+	@staticmethod
+	def map(fname):
+		with open(fname, 'rb') as f:
+			if os.fstat(f.fileno()).st_size == 0:
+				return memoryview(b'')
+
+			return memoryview(mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ))
+
+	## Store an artifact, replacing the previous version
+	# @param self	Object pointer
+	# @param name		Name of the artifact
+	# @param version	Version of the artifact
+	# @param data		The artifact
+	# @param alias		Alias of this version, or None
+	# @return		Key of the artifact, its file name in the store
+	#
+	# Files are written under a temporary name and then renamed, so other
+	# processes never see them half written. The index of a name holds the
+	# key of its version and the directory of its alias, so both can be
+	# removed when it is replaced.
+	def publish(self, name, version, data, alias = None):
+		key = digest(name + '\0' + version)
+		fname = os.path.join(self.directory, key)
+		ndigest = digest(name)
+		index = os.path.join(self.directory, 'names', ndigest)
+		adir = os.path.join(self.directory, 'aliases', digest(alias)) if alias else ''
+		tmp = '.{}.tmp'.format(os.getpid())
+
+		with open(fname + tmp, 'wb') as f:
+			f.write(data)
+		os.replace(fname + tmp, fname)
+
+		if adir:
+			os.makedirs(adir, exist_ok = True)
+
+			with open(os.path.join(adir, ndigest + tmp), 'w', encoding = 'utf-8') as f:
+				f.write(version + '\n' + name)
+			os.replace(os.path.join(adir, ndigest + tmp), os.path.join(adir, ndigest))
+
+		try:
+			with open(index, 'r') as f:
+				old, old_adir = (f.read().split('\n') + [''])[:2]
+		except FileNotFoundError:
+			old, old_adir = None, ''
+
+		with open(index + tmp, 'w') as f:
+			f.write(key + '\n' + adir)
+		os.replace(index + tmp, index)
+
+		if old and old != key:
+			try:
+				os.remove(os.path.join(self.directory, old))
+			except FileNotFoundError:
+				pass
+
+		if old_adir and old_adir != adir:
+			try:
+				os.remove(os.path.join(old_adir, ndigest))
+				os.rmdir(old_adir)
+			except OSError:
+				# other names still have the alias
+				pass
+
+		return key
+
+	## Get the store's current status
+	def status(self):
+		return SStats(self.hits, self.shared, self.misses, len(self.local.cache))
+
+## Store used by the presentations and the manager
+store = Store()
+
+metrics.register_cache('shared', store.status, lambda: store.local.cache)
+
+## @}
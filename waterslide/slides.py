@@ -0,0 +1,282 @@
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import re
+import hashlib
+from collections import namedtuple
+
+##
+#  @defgroup slides Slide parsing module
+#
+# The presentation body is split into its top-level \<section\> elements (the
+# horizontal slides, including any vertical slides nested in them) and the
+# markup in between. Each of these segments is identified by the hash of its
+# content, so that when the presentation changes only the slides which
+# actually changed have to be processed again.
+#
+# Processing happens in stages. A stage is a function which is applied to each
+# slide, and its results are cached by the slide's digest. Stages only see the
+# slides they haven't processed yet, which makes an edit to one slide of a
+# large deck cost the processing of one slide.
+#
+#  @addtogroup slides
+#  @{
+#
+
+## Segment of a presentation body
+#
+# html is the markup of the segment, digest its content hash and section
+# whether it is a top-level \<section\> element (as opposed to the whitespace,
+# comments, etc. in between)
+Slide = namedtuple('Slide', ('html', 'digest', 'section'))
+
+## Difference between two versions of a deck
+#
+# added contains the indices (in the new deck) of the slides which weren't in
+# the old deck, removed the digests of the slides which are no longer in it
+Delta = namedtuple('Delta', ('added', 'removed'))
+
+## Expression matching section tags, and comments (which are skipped)
+tags = re.compile(r'<!--.*?-->|<(/?)section\b[^>]*>', re.I | re.S)
+
+## Hash a string
+# @param text	String to hash
+# @return	Hexadecimal digest of the string
+def digest(text):
+	return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+## Create a slide from a string
+# @param html		Markup of the slide
+# @param section	Whether it is a top-level section
+def slide(html, section):
+	return Slide(html, digest(html), section)
+
+## Split a presentation body into its top-level sections
+# @param html	Presentation body
+# @return	List of Slide tuples, which joined form the original body
+def split(html):
+	segments = []
+
+	depth = 0
+	# start of the current top-level section
+	start = 0
+	# end of the last segment
+	pos = 0
+
+	for m in tags.finditer(html):
+
+		if m.group(0).startswith('<!--'):
+			continue
+
+		if m.group(1) != '/':
+			if depth == 0:
+				if m.start() > pos:
+					segments.append(slide(html[pos:m.start()], False))
+				start = m.start()
+			depth += 1
+
+		# ignore stray closing tags
+		elif depth > 0:
+			depth -= 1
+
+			if depth == 0:
+				segments.append(slide(html[start:m.end()], True))
+				pos = m.end()
+
+	# an unterminated section runs up to the end of the body, like it would
+	# in a browser
+	if depth > 0:
+		segments.append(slide(html[start:], True))
+	elif pos < len(html):
+		segments.append(slide(html[pos:], False))
+
+	return segments
+
+## Expression matching the opening tag of a section
+opening = re.compile(r'<section\b[^>]*>', re.I)
+
+## Create an empty placeholder for a top-level section
+# @param html	Markup of the section
+# @param index	Index of the section in the deck
+# @return	The opening tag of the section, marked with its index, and its
+#		closing tag
+#
+# The placeholder keeps the attributes of the section (backgrounds,
+# transitions, etc.), so that Reveal can already show it as it should
+def placeholder(html, index):
+	m = opening.match(html)
+	tag = m.group(0) if m else '<section>'
+
+	return '<section data-ws-slide="{}"{}</section>'.format(index, tag[len('<section'):])
+
+## Expression matching the source attribute of media elements
+media_src = re.compile(r'(<(?:img|video|audio|source|iframe)\b[^>]*?\s)src=', re.I)
+
+## Expression matching the attributes which reference assets
+asset_attrs = re.compile(
+	r'\s(?:src|data-src|poster|data-background-image|data-background-video|data-background)'
+	r'\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.I)
+
+## Rewrite the media of a slide to Reveal's lazy loaded form
+# @param html	Markup of the slide
+# @return	The markup, with the 'src' attributes of images, videos, audio
+#		and iframes renamed to 'data-src'
+#
+# Reveal only loads the media of the slides close to the current one then.
+def lazy_media(html):
+	return media_src.sub(r'\1data-src=', html)
+
+## Expression matching css colour and gradient values ('rgba(0,0,0,0.5)')
+css_colours = re.compile(
+	r'\s*(rgba?|hsla?|hwb|lab|lch|color|(repeating-)?(linear|radial|conic)-gradient)\(', re.I)
+
+## Expression matching urls with a scheme, and paths to a file ('img/a.png')
+url_like = re.compile(r'[a-z][a-z0-9+.-]*:|//|(.*/)?[^/?#]+\.[a-z0-9]+([?#]|$)', re.I)
+
+## Check whether the value of an attribute refers to a file
+# @param url	Value of the attribute
+#
+# Inline data, colours ('#fff', 'red', 'rgba(0,0,0,0.5)'), gradients,
+# fragments and scripts are not files. Everything else has to look like a url
+# or a path to a file with an extension.
+def is_asset(url):
+	return bool(url) and not url.startswith(('data:', 'javascript:', '#')) and \
+		not css_colours.match(url) and bool(url_like.match(url))
+
+## Find the assets a slide references
+# @param html	Markup of the slide
+# @return	Tuple of the urls of the assets, without duplicates
+def assets(html):
+	urls = []
+
+	for m in asset_attrs.finditer(html):
+		url = m.group(1) or m.group(2)
+
+		if is_asset(url) and url not in urls:
+			urls.append(url)
+
+	return tuple(urls)
+
+## Presentation body, split into slides
+class Deck():
+
+	## Slides (Slide tuples) in the deck
+	slides = ()
+
+	## Digest of the whole body
+	digest = None
+
+	## Changes made by the last update
+	delta = Delta((), ())
+
+	def __init__(self, html = ''):
+		# stage name -> (function, {slide digest: result})
+		self.stages = {}
+		# memo key -> (deck digest, result)
+		self.memos = {}
+
+		self.update(html)
+
+	## Update the deck with a new presentation body
+	# @param self	Object pointer
+	# @param html	The new presentation body
+	# @return	Delta tuple describing the changed slides
+	#
+	# The results of the stages are dropped for the slides which are no longer
+	# in the deck.
+	def update(self, html):
+
+		d = digest(html)
+
+		if d == self.digest:
+			self.delta = Delta((), ())
+			return self.delta
+
+		old = set(s.digest for s in self.slides)
+
+		self.slides = tuple(split(html))
+		self.digest = d
+
+		new = set(s.digest for s in self.slides)
+
+		self.delta = Delta(
+			added = tuple(i for i, s in enumerate(self.slides) if s.digest not in old),
+			removed = tuple(old - new),
+		)
+
+		for func, results in self.stages.values():
+			for r in self.delta.removed:
+				results.pop(r, None)
+
+		return self.delta
+
+	## Top-level sections in the deck
+	@property
+	def sections(self):
+		return self.memo('sections', lambda: tuple(s for s in self.slides if s.section))
+
+	## Register a processing stage
+	# @param self	Object pointer
+	# @param name	Name of the stage
+	# @param func	Function which takes a Slide tuple and returns the
+	#		result of the stage for that slide
+	def add_stage(self, name, func):
+		self.stages[name] = (func, {})
+		self.memos = {}
+
+	## Get the results of a stage, for each slide in the deck
+	# @param self	Object pointer
+	# @param name	Name of the stage
+	# @return	Tuple of results, in the same order as the slides
+	#
+	# Only the slides which the stage hasn't seen yet are processed.
+	def stage(self, name):
+		func, results = self.stages[name]
+
+		out = []
+
+		for s in self.slides:
+			r = results.get(s.digest, results)
+
+			if r is results:
+				r = results[s.digest] = func(s)
+
+			out.append(r)
+
+		return tuple(out)
+
+	## Memoise a value derived from the deck, until the deck changes
+	# @param self	Object pointer
+	# @param key	Key identifying the value
+	# @param func	Callable without arguments which computes the value
+	# @return	The value, which is only computed again when the deck has
+	#		changed
+	def memo(self, key, func):
+		d, ret = self.memos.get(key, (None, None))
+
+		if d != self.digest:
+			ret = func()
+			self.memos[key] = (self.digest, ret)
+
+		return ret
+
+	## Get the results of a string producing stage joined together
+	# @param self	Object pointer
+	# @param name	Name of the stage
+	# @return	The joined results
+	def join(self, name):
+		return self.memo(('join', name), lambda: ''.join(self.stage(name)))
+
+	## Get the results of a stage for the top-level sections only
+	# @param self	Object pointer
+	# @param name	Name of the stage
+	# @return	Tuple of results, in the same order as the sections
+	def section_stage(self, name):
+		return self.memo(('sections', name), lambda: tuple(
+			r for s, r in zip(self.slides, self.stage(name)) if s.section))
+
+## @}
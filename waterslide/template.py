@@ -0,0 +1,77 @@
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import re
+
+##
+#  @defgroup template Page template module
+#
+# Pages are compiled once per version of the presentation into a template: a
+# tuple of utf-8 encoded segments with holes in between them. Only the holes
+# (such as the multiplex configuration) are filled in when a page is
+# requested, the rest is sent as is.
+#
+#  @addtogroup template
+#  @{
+#
+
+## Expression matching the hole markers in a page
+markers = re.compile('\x00([a-z_]+)\x00')
+
+## Get the marker of a hole, to be put in the page before compiling it
+# @param name	Name of the hole
+def hole(name):
+	return '\x00' + name + '\x00'
+
+## Compiled page template
+class Template():
+
+	## Compile a page
+	# @param self	Object pointer
+	# @param parts	Iterable of the parts of the page. Strings may contain
+	#		hole markers, bytes are taken as they are (and not
+	#		copied)
+	def __init__(self, parts):
+		segments = []
+		holes = []
+
+		for part in parts:
+			if not isinstance(part, str):
+				segments.append(part)
+				continue
+
+			# the split alternates between text and hole names
+			for i, s in enumerate(markers.split(part)):
+				if i % 2:
+					holes.append(len(segments))
+					segments.append(s)
+				elif s:
+					segments.append(s.encode('utf-8'))
+
+		## The encoded segments, with the names of the holes in between
+		self.segments = tuple(segments)
+		## Indices of the holes in the segments
+		self.holes = tuple(holes)
+
+	## Fill in the holes of the template
+	# @param self	Object pointer
+	# @param values	Dictionary with the encoded value of each hole
+	# @return	Sequence of the encoded segments of the page
+	#
+	# A template without holes returns its segments as they are.
+	def render(self, values = {}):
+		if not self.holes:
+			return self.segments
+
+		segments = list(self.segments)
+
+		for i in self.holes:
+			segments[i] = values[segments[i]]
+
+		return segments
+
+## @}
@@ -0,0 +1,130 @@
+# (C) 2017 Niels ter Meer
+# This file is part of the WaterSlide presentation program
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+
+##
+#  @defgroup timing Request phase timing module
+#
+# Times the phases of handling a request (converting it, dispatching it,
+# reloading the presentation, rendering, compiling, ...), which are sent to
+# the client in a Server-Timing header, and optionally logged.
+#
+# Streamed pages are written after their headers are sent, so the time spent
+# writing them (their export phase) is only in the log.
+#
+# Request handlers run synchronously on the event loop, so only one request
+# is being timed at any moment, and the timings of the current request can be
+# kept in a module variable. Phases outside of a request are not recorded.
+#
+#  @addtogroup timing
+#  @{
+#
+
+## Whether the Server-Timing header is sent
+enabled = True
+
+## Whether the timings are logged
+log = False
+
+## Timings of the request currently being handled, or None
+current = None
+
+## Timings of the phases of a request
+class Timings():
+
+	def __init__(self):
+		## Start of the request
+		self.start = time.perf_counter()
+		## List of (phase, duration in seconds), in the order they ended
+		self.phases = []
+
+	## Record the duration of a phase
+	def add(self, name, duration):
+		self.phases.append((name, duration))
+
+	## Get the timings as the value of a Server-Timing header
+	# @param self	Object pointer
+	# @return	The phases and the total duration, in milliseconds
+	def header(self):
+		return ', '.join('{};dur={:.2f}'.format(name, d * 1000) for name, d in
+			self.phases + [('total', time.perf_counter() - self.start)])
+
+## Start timing a request
+# @return	The Timings of the request, or None when timing is disabled
+def begin():
+	global current
+	current = Timings() if enabled or log else None
+	return current
+
+## Stop timing the current request
+def end():
+	global current
+	current = None
+
+## Log the timings of a request, when logging is enabled
+# @param path		Path of the request
+# @param timings	Timings of the request, or None
+def report(path, timings):
+	if timings is not None and log:
+		print("timing {}: {}".format(path, timings.header()))
+
+## Context manager timing a phase of the current request
+#
+# There is one per phase name, so entering a phase outside of a timed request
+# doesn't make any objects. Phases of the same name may be nested, each entry
+# is kept on a stack.
+class Phase():
+
+	__slots__ = ('name', 'entries')
+
+	def __init__(self, name):
+		self.name = name
+		# (timings, start) of each entry, or None when it isn't timed
+		self.entries = []
+
+	def __enter__(self):
+		timings = current
+		self.entries.append(None if timings is None else (timings, time.perf_counter()))
+
+	def __exit__(self, *exc):
+		entry = self.entries.pop()
+
+		if entry is not None:
+			entry[0].add(self.name, time.perf_counter() - entry[1])
+
+## Phases, by name
+phases = {}
+
+## Time a phase of the current request
+# @param name	Name of the phase, as it appears in the header
+# @return	Context manager timing the phase
+def phase(name):
+	p = phases.get(name)
+
+	if p is None:
+		p = phases[name] = Phase(name)
+
+	return p
+
+## Decorator timing every call of a function as a phase
+# @param name	Name of the phase
+def timed(name):
+
+	def boot(func):
+
+		p = phase(name)
+
+		def decorator(*args, **kwargs):
+			with p:
+				return func(*args, **kwargs)
+
+		return decorator
+
+	return boot
+
+## @}
@@ -62,30 +62,34 @@ def read_data_file(fname = None):
 def of_commit(commit_ish = "HEAD"):
 	# the version is the output of the git describe command, from 
 	# the 'v' up to but not including the trailing newline.
-	vstr = (subprocess.run(["git", "describe", "--long", "--first-parent", "--match=v*", commit_ish],
-			stdout=subprocess.PIPE,
-			stderr=subprocess.PIPE
-			)
-		) \
-		.stdout \
-		.decode("utf8")[1:-1] #strip the 'v' and '\n' at the beginning and the end
+	try:
+		vstr = (subprocess.run(["git", "describe", "--long", "--first-parent", "--match=v*", commit_ish],
+				stdout=subprocess.PIPE,
+				stderr=subprocess.PIPE
+				)
+			) \
+			.stdout \
+			.decode("utf8")[1:-1] #strip the 'v' and '\n' at the beginning and the end
+	# git is not installed
+	except OSError:
+		return None
 	
 	return parse_vstring(vstr)
 
 class version:
 	
-	## Program version information.
-	#
-	# Defaults to zeroes, get's updated during module initalisation. It first
-	# checks the datafile (which shouldn't exists while developing), and then
-	# resorts to asking git for the data.
-	version		= vdef('0.0.0', 0, '0')
+	## Fallback version information, for when neither the data file nor
+	# git can tell us anything
+	fallback	= vdef('0.0.0', '0', '0')
+	
+	## Version string from the data file, None if there is none
+	vstr		= None
 	
 	## program buildtime.
 	#
 	# Defaults to 0, but gets updated during module initialisation. It first
 	# checks the datafile (which shouldn't exists while developing), and then
-	# resorts to asking git for the data.
+	# resorts to the current time.
 	buildtime	= 0
 	
 	## Initialise version object
@@ -95,9 +99,21 @@ class version:
 		t = {} if skip_data_file else \
 			read_data_file('data.json') or read_data_file()
 		
-		self.version = parse_vstring(t.get('version')) or of_commit() or version
+		self.vstr = t.get('version')
 		self.buildtime = t.get('buildtime') or time.time()
+	
+	## Program version information.
+	#
+	# It first checks the datafile (which shouldn't exists while developing),
+	# and then resorts to asking git for the data. Git is only invoked
+	# on first access, since it is relatively slow.
+	@property
+	def version(self):
+		if '_version' not in self.__dict__:
+			self._version = parse_vstring(self.vstr) or \
+				of_commit() or self.fallback
 		
+		return self._version
 
 	## Get a pep440 compatible version identifier
 	#
@@ -8,7 +8,7 @@
 from sys import argv
 import sys
 import os
-from waterslide import serve, presentation, version, manager
+from waterslide import version
 import datetime, time
 
 ##
@@ -24,6 +24,28 @@ import datetime, time
 def no_func(argn):
 	print("No subcommand provided")
 
+## Serve subcommand wrapper
+# @copydetails no_func
+#
+# The serving subcommands pull in aiohttp, socketio, libsass and friends. They
+# are only imported when such a subcommand is actually invoked, so the cheap
+# subcommands (version, conf) return immediately.
+def serve_cmd(argn):
+	from waterslide import serve
+	return serve.serve(argn)
+
+## Manage subcommand wrapper
+# @copydetails serve_cmd
+def manage_cmd(argn):
+	from waterslide import manager
+	return manager.serve(argn)
+
+## Export subcommand wrapper
+# @copydetails serve_cmd
+def export_cmd(argn):
+	from waterslide import export
+	return export.export(argn)
+
 ## Function to show the waterslide program version
 # @copydetails no_func
 def show_version(argn):
@@ -129,6 +151,8 @@ Main options:
 
 Subcommands:
 serve              Serve (a) presentation(s) over http
+manage             Manage a document root of presentations
+export             Export presentations to static files
 conf               Show configuration related data, paths and such
 version            see --version
 '''
@@ -146,13 +170,16 @@ version            see --version
 			print(helptext)
 			sys.exit(0)
 		elif argv[i] == "serve":
-			subcmd = serve.serve
+			subcmd = serve_cmd
 			break
 		elif argv[i] == "conf":
 			subcmd = conf
 			break
 		elif argv[i] == "manage":
-			subcmd = manager.serve
+			subcmd = manage_cmd
+			break
+		elif argv[i] == "export":
+			subcmd = export_cmd
 			break
 	
 		i += 1
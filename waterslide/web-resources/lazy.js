@@ -0,0 +1,102 @@
+/**
+ * (C) 2017 Niels ter Meer
+ * This file is part of the WaterSlide presentation program
+ *
+ * This Source Code Form is subject to the terms of the Mozilla Public
+ * License, v. 2.0. If a copy of the MPL was not distributed with this
+ * file, You can obtain one at http://mozilla.org/MPL/2.0/.
+ */
+
+// Lazy slide loading plugin.
+//
+// The initial page only contains the first slides, the others are empty
+// placeholders marked with their index (data-ws-slide). Whenever the viewer
+// approaches a placeholder, the chunk it is in is fetched from the
+// presentation ('?slides=<first>-<last>') and the placeholders are replaced.
+(function() {
+
+	var conf = Reveal.getConfig().waterslideLazy;
+
+	if (!conf)
+		return;
+
+	// chunks which are being or have been fetched
+	var requested = {};
+
+	function placeholder(index) {
+		return document.querySelector(
+			'.reveal .slides > section[data-ws-slide="' + index + '"]');
+	}
+
+	/**
+	 * Fill in the placeholders of a chunk
+	 * @param first		Index of the first slide in the chunk
+	 * @param slides	List of the slides' markup
+	 */
+	function fill(first, slides) {
+		var container = document.createElement('div');
+		var current = Reveal.getIndices();
+
+		slides.forEach(function(html, i) {
+			var p = placeholder(first + i);
+
+			if (!p)
+				return;
+
+			container.innerHTML = html;
+			p.parentNode.replaceChild(container.firstElementChild, p);
+		});
+
+		Reveal.sync();
+		// the current slide might have been replaced, so show it again
+		Reveal.slide(current.h, current.v, current.f);
+	}
+
+	/**
+	 * Fetch the chunk which contains a slide
+	 * @param index		Index of the slide
+	 *
+	 * Chunks are aligned on the chunk size, so that they can be cached
+	 */
+	function fetch(index) {
+		var first = index - index % conf.chunk;
+
+		if (requested[first])
+			return;
+
+		requested[first] = true;
+
+		var xhr = new XMLHttpRequest();
+		xhr.open('GET', '?slides=' + first + '-' + (first + conf.chunk));
+
+		xhr.onload = function() {
+			if (xhr.status !== 200) {
+				requested[first] = false;
+				return;
+			}
+
+			fill(first, JSON.parse(xhr.responseText));
+		};
+
+		xhr.onerror = function() {
+			requested[first] = false;
+		};
+
+		xhr.send();
+	}
+
+	// load the slides within reach of the current slide
+	function check() {
+		var h = Reveal.getIndices().h;
+
+		for (var i = h; i <= h + conf.distance; i++) {
+			if (placeholder(i))
+				fetch(i);
+		}
+	}
+
+	Reveal.addEventListener('ready', check);
+	Reveal.addEventListener('slidechanged', check);
+
+	check();
+}());
@@ -0,0 +1,122 @@
+/**
+ * (C) 2017 Niels ter Meer
+ * This file is part of the WaterSlide presentation program
+ *
+ * This Source Code Form is subject to the terms of the Mozilla Public
+ * License, v. 2.0. If a copy of the MPL was not distributed with this
+ * file, You can obtain one at http://mozilla.org/MPL/2.0/.
+ */
+
+// Offline service worker.
+//
+// The server puts the version and the manifest (address -> content hash) of
+// the presentation in front of this script. On install, the entries whose
+// hash differs from the manifest of the last install are fetched into the
+// cache, the others are kept as they are. The page itself is fetched from the
+// network first, everything else in the manifest from the cache first.
+
+// every presentation on the server has its own cache
+var cacheName = 'waterslide:' + self.registration.scope;
+
+// the version and manifest of the entries currently in the cache are stored in
+// the cache too
+var stored = new URL('waterslide-sw-manifest.json', self.registration.scope).href;
+
+function address(entry) {
+	return new URL(entry, self.registration.scope).href;
+}
+
+function request(entry) {
+	var url = address(entry);
+
+	// responses from other origins can only be cached opaquely
+	if (new URL(url).origin !== location.origin)
+		return new Request(url, { mode: 'no-cors' });
+
+	return new Request(url, { cache: 'reload' });
+}
+
+self.addEventListener('install', function(event) {
+	event.waitUntil(caches.open(cacheName).then(function(cache) {
+
+		return cache.match(stored).then(function(response) {
+			return response ? response.json() : { entries: {} };
+		}).then(function(last) {
+
+			var old = last.entries;
+
+			var current = {};
+
+			var updates = Object.keys(manifest).map(function(entry) {
+
+				if (old[entry] === manifest[entry]) {
+					current[entry] = old[entry];
+					return null;
+				}
+
+				var req = request(entry);
+
+				return fetch(req).then(function(response) {
+					if (!response.ok && response.type !== 'opaque')
+						throw new Error(response.status);
+
+					current[entry] = manifest[entry];
+					return cache.put(address(entry), response);
+				}).catch(function() {
+					// try again on the next install
+					if (old[entry])
+						current[entry] = old[entry];
+				});
+			});
+
+			return Promise.all(updates).then(function() {
+
+				// drop the entries which are no longer used
+				var removed = Object.keys(old).filter(function(entry) {
+					return !(entry in manifest);
+				}).map(function(entry) {
+					return cache.delete(address(entry));
+				});
+
+				return Promise.all(removed);
+			}).then(function() {
+				return cache.put(stored, new Response(JSON.stringify({
+					version: version,
+					entries: current
+				}), {
+					headers: { 'Content-Type': 'application/json' }
+				}));
+			});
+		});
+	}).then(function() {
+		return self.skipWaiting();
+	}));
+});
+
+self.addEventListener('activate', function(event) {
+	event.waitUntil(self.clients.claim());
+});
+
+self.addEventListener('fetch', function(event) {
+
+	if (event.request.method !== 'GET')
+		return;
+
+	// the page, possibly with a multiplex session in the query
+	if (event.request.mode === 'navigate') {
+		event.respondWith(fetch(event.request).catch(function() {
+			return caches.open(cacheName).then(function(cache) {
+				return cache.match(address('./'));
+			}).then(function(response) {
+				return response || Response.error();
+			});
+		}));
+		return;
+	}
+
+	event.respondWith(caches.open(cacheName).then(function(cache) {
+		return cache.match(event.request.url).then(function(response) {
+			return response || fetch(event.request);
+		});
+	}));
+});
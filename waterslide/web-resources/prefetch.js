@@ -0,0 +1,47 @@
+/**
+ * (C) 2017 Niels ter Meer
+ * This file is part of the WaterSlide presentation program
+ *
+ * This Source Code Form is subject to the terms of the Mozilla Public
+ * License, v. 2.0. If a copy of the MPL was not distributed with this
+ * file, You can obtain one at http://mozilla.org/MPL/2.0/.
+ */
+
+// Media prefetching plugin.
+//
+// WaterSlide passes a manifest of the assets referenced by each (horizontal)
+// slide. Whenever the slide changes, the assets of the next few slides are
+// prefetched, so they are in the browser's cache when the audience gets
+// there.
+(function() {
+
+	var conf = Reveal.getConfig().waterslideMedia;
+
+	if (!conf || !conf.assets)
+		return;
+
+	// urls which have already been prefetched
+	var fetched = {};
+
+	function prefetch(url) {
+		if (fetched[url])
+			return;
+
+		fetched[url] = true;
+
+		var link = document.createElement('link');
+		link.rel = 'prefetch';
+		link.href = url;
+		document.head.appendChild(link);
+	}
+
+	function check() {
+		var h = Reveal.getIndices().h;
+
+		for (var i = h + 1; i <= h + conf.prefetch && i < conf.assets.length; i++)
+			conf.assets[i].forEach(prefetch);
+	}
+
+	Reveal.addEventListener('ready', check);
+	Reveal.addEventListener('slidechanged', check);
+}());